@@ -0,0 +1,344 @@
+"""
+Faster R-CNN bird detection for track_birds2.py, plus an on-disk cache of the raw per-frame detections
+so that re-runs with different tracker settings or score thresholds skip the network entirely, and a
+motion-gated mode that only runs the network on crops around regions that changed.
+"""
+import hashlib
+import os
+
+import cv2
+import numpy as np
+import torch
+from torchvision.models.detection import (fasterrcnn_mobilenet_v3_large_320_fpn, fasterrcnn_mobilenet_v3_large_fpn,
+                                          fasterrcnn_resnet50_fpn)
+from torchvision.ops import batched_nms
+
+BIRD_LABEL = 16  # COCO class for birds
+MODEL_NAME = 'fasterrcnn_resnet50_fpn'
+MODELS = {'fasterrcnn_resnet50_fpn': fasterrcnn_resnet50_fpn,
+          'fasterrcnn_mobilenet_v3_large_fpn': fasterrcnn_mobilenet_v3_large_fpn,
+          'fasterrcnn_mobilenet_v3_large_320_fpn': fasterrcnn_mobilenet_v3_large_320_fpn}
+
+# Inference profiles: the model, the short side frames are scaled to before the network (boxes come back in
+# frame coordinates, None keeps the model default), and whether the linear layers run as dynamic int8 on CPU
+PROFILES = {'accurate': {'model': 'fasterrcnn_resnet50_fpn', 'input_size': None, 'quantize': False},
+            'balanced': {'model': 'fasterrcnn_mobilenet_v3_large_fpn', 'input_size': 800, 'quantize': True},
+            'fast': {'model': 'fasterrcnn_mobilenet_v3_large_fpn', 'input_size': 480, 'quantize': True},
+            'fastest': {'model': 'fasterrcnn_mobilenet_v3_large_320_fpn', 'input_size': 320, 'quantize': True}}
+
+
+def model_key(model_name=MODEL_NAME, input_size=None, quantize=False):
+    """
+    Names a model configuration, for the detection and TorchScript caches. The stock configuration keeps
+    the plain model name, so caches written before profiles existed stay valid.
+    """
+    key = model_name
+    if input_size is not None:
+        key += '@%d' % input_size
+    if quantize:
+        key += '-int8'
+    return key
+
+
+def load_model(device, model_name=MODEL_NAME, input_size=None, quantize=False, threads=None, script_dir=None):
+    """
+    Loads a pre-trained detector. input_size overrides the short side frames are scaled to, quantize
+    converts the linear layers to dynamic int8 (CPU only) and threads sets the intra-op thread count.
+    With script_dir the prepared model is cached there as TorchScript, which loads much faster than
+    building and quantizing it again; the scripted model is then returned instead.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    quantize = quantize and device.type == 'cpu'
+    script_path = None
+    if script_dir is not None:
+        name = '%s-torch%s.pt' % (model_key(model_name, input_size, quantize), torch.__version__)
+        script_path = os.path.join(script_dir, name)
+        if os.path.exists(script_path):
+            return torch.jit.load(script_path, map_location=device).eval()
+
+    # Load the pre-trained Faster R-CNN model and move to device
+    # the long side is capped in the same 800:1333 ratio torchvision uses by default
+    kwargs = {} if input_size is None else {'min_size': input_size, 'max_size': input_size * 1333 // 800}
+    model = MODELS[model_name](pretrained=True, **kwargs).to(device)
+    model.eval()
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if script_path is not None:
+        scripted = torch.jit.script(model)
+        os.makedirs(script_dir, exist_ok=True)
+        # several processes may prepare the same model at once, each writes its own file
+        tmp_path = '%s.tmp%d' % (script_path, os.getpid())
+        torch.jit.save(scripted, tmp_path)
+        os.replace(tmp_path, script_path)
+        model = scripted.eval()
+    return model
+
+
+class FrameTensors(object):
+    """
+    Converts BGR uint8 frames to the RGB float CHW tensors in [0, 1] the detector expects. Unlike
+    transforms.ToTensor, which hands the network OpenCV's BGR channels as RGB, the channels are swapped while
+    the frame is copied out of a zero-copy torch.from_numpy view. Frames of one size are stacked into a batch
+    buffer on the device that is allocated once and reused by every call, so the tensors returned are only
+    valid until the next call. Frames of mixed sizes, such as crops, get a tensor each.
+    """
+
+    def __init__(self, device=torch.device('cpu')):
+        self.device = device
+        self.buffer = None
+
+    def batch(self, count, height, width):
+        """
+        Returns the first count frames of the buffer, growing it if it is too small for them.
+        """
+        if self.buffer is None or self.buffer.shape[0] < count or self.buffer.shape[2:] != (height, width):
+            self.buffer = torch.empty((count, 3, height, width), dtype=torch.float32, device=self.device)
+        return self.buffer[:count]
+
+    def __call__(self, frames):
+        shapes = set(frame.shape[:2] for frame in frames)
+        if len(shapes) == 1:
+            tensors = self.batch(len(frames), *shapes.pop())
+        else:
+            tensors = [torch.empty((3,) + frame.shape[:2], dtype=torch.float32, device=self.device)
+                       for frame in frames]
+        for tensor, frame in zip(tensors, frames):
+            source = torch.from_numpy(frame)
+            # copy_ converts to float and moves to the device on the way; reading BGR backwards gives RGB
+            for channel in range(3):
+                tensor[channel].copy_(source[:, :, 2 - channel])
+            tensor.div_(255)
+        return list(tensors)
+
+
+def run_model(model, frames, device, transform):
+    """
+    Runs the model on a batch of frames and returns the raw (boxes, labels, scores) of every frame as numpy
+    arrays. transform turns the list of frames into a list of tensors on the device, like FrameTensors.
+    """
+    frame_tensors = [tensor.to(device) for tensor in transform(frames)]
+
+    # Run the model on the whole batch to get detections
+    with torch.no_grad():
+        predictions = model(frame_tensors)
+    if isinstance(predictions, tuple):
+        # scripted detection models always return (losses, detections)
+        predictions = predictions[1]
+
+    # Extract boxes, labels, and scores
+    return [(prediction['boxes'].cpu().numpy(), prediction['labels'].cpu().numpy(),
+             prediction['scores'].cpu().numpy()) for prediction in predictions]
+
+
+class MotionRegions(object):
+    """
+    Cheap region proposals for the detector: the frame is shrunk by scale, blurred and compared with a
+    running average of the previous frames, and the bounding boxes of the pixels that changed by more than
+    threshold grey levels are returned as Nx4 [x1,y1,x2,y2] rows in full frame coordinates. The first frame
+    only initialises the background and returns None, as nothing is known about it yet.
+    """
+
+    def __init__(self, scale=0.25, threshold=12, learning_rate=0.1, min_area=2):
+        self.scale = scale
+        self.threshold = threshold
+        self.learning_rate = learning_rate
+        self.min_area = min_area
+        self.background = None
+
+    def __call__(self, frame):
+        small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (3, 3), 0).astype(np.float32)
+        if self.background is None:
+            self.background = small
+            return None
+        mask = (cv2.absdiff(small, self.background) > self.threshold).astype(np.uint8)
+        cv2.accumulateWeighted(small, self.background, self.learning_rate)
+        # join the leading and trailing edges of a moving bird into one blob
+        mask = cv2.dilate(mask, np.ones((3, 3), np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        rects = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) >= self.min_area]
+        if not rects:
+            return np.empty((0, 4))
+        rects = np.array(rects, dtype=float)
+        return np.concatenate((rects[:, :2], rects[:, :2] + rects[:, 2:]), axis=1) / self.scale
+
+
+def region_crops(regions, frame_size, crop_size=320, max_zoom=4., pad=0.5):
+    """
+    Covers the regions with as few crops as possible. Each region is padded by pad times its size on every
+      side and grown to at least crop_size / max_zoom pixels, so that the detector, which scales every crop
+      to crop_size, sees small birds at up to max_zoom times their size. Overlapping crops are merged.
+      Returns Kx4 int [x1,y1,x2,y2] crops inside the frame.
+    """
+    width, height = frame_size
+    if len(regions) == 0:
+        return np.empty((0, 4), dtype=int)
+    regions = np.asarray(regions, dtype=float)
+    size = regions[:, 2:4] - regions[:, 0:2]
+    lo = regions[:, 0:2] - pad * size
+    hi = regions[:, 2:4] + pad * size
+    grow = np.maximum(crop_size / max_zoom - (hi - lo), 0.) / 2.
+    crops = np.concatenate((lo - grow, hi + grow), axis=1)
+    merged = True
+    while merged and len(crops) > 1:
+        merged = False
+        for i in range(len(crops)):
+            overlap = ((crops[:, 0] < crops[i, 2]) & (crops[:, 2] > crops[i, 0]) &
+                       (crops[:, 1] < crops[i, 3]) & (crops[:, 3] > crops[i, 1]))
+            if overlap.sum() > 1:
+                union = np.concatenate((crops[overlap, :2].min(axis=0), crops[overlap, 2:].max(axis=0)))
+                crops = np.vstack((crops[~overlap], union))
+                merged = True
+                break
+    # shift crops that stick out of the frame back inside it before clipping
+    limit = np.array([width, height], dtype=float)
+    shift = np.maximum(-crops[:, 0:2], 0.) - np.maximum(crops[:, 2:4] - limit, 0.)
+    crops = crops + np.tile(shift, 2)
+    crops[:, 0:2] = np.maximum(crops[:, 0:2], 0.)
+    crops[:, 2:4] = np.minimum(crops[:, 2:4], limit)
+    return np.concatenate((np.floor(crops[:, :2]), np.ceil(crops[:, 2:])), axis=1).astype(int)
+
+
+def run_model_on_crops(model, frame, crops, device, transform, crop_size=320, nms_threshold=0.5):
+    """
+    Runs the model once on all the crops of a frame, each scaled by the model to crop_size on its long side,
+      and returns the raw (boxes, labels, scores) in frame coordinates like run_model. Birds seen by more
+      than one crop are de-duplicated by non-maximum suppression.
+    """
+    if len(crops) == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    # the model's own resize step sets the effective resolution, so point it at the crop size for this call
+    resize = getattr(model, 'transform', None)
+    if resize is not None:
+        full_size = resize.min_size, resize.max_size
+        resize.min_size, resize.max_size = (crop_size,), crop_size
+    try:
+        raw = run_model(model, [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in crops], device, transform)
+    finally:
+        if resize is not None:
+            resize.min_size, resize.max_size = full_size
+    boxes = np.concatenate([b + np.tile(crop[:2], 2).astype(b.dtype) for crop, (b, _, _) in zip(crops, raw)])
+    labels = np.concatenate([l for _, l, _ in raw])
+    scores = np.concatenate([s for _, _, s in raw])
+    keep = batched_nms(torch.from_numpy(boxes), torch.from_numpy(scores), torch.from_numpy(labels),
+                       nms_threshold).numpy()
+    return boxes[keep], labels[keep], scores[keep]
+
+
+class MotionGatedDetector(object):
+    """
+    Runs the model only where MotionRegions saw change: on crops around the moving regions, or not at all
+    when nothing moved. Every full_frame_every-th pass covers the whole frame, to pick up birds that sit
+    still. Called with a list of frames, it returns the raw detections of each like run_model.
+    """
+
+    def __init__(self, model, device, transform, frame_size, full_frame_every=25, crop_size=320, max_zoom=4.):
+        self.model = model
+        self.device = device
+        self.transform = transform
+        self.frame_size = frame_size
+        self.full_frame_every = max(1, full_frame_every)
+        self.crop_size = crop_size
+        self.max_zoom = max_zoom
+        self.proposer = MotionRegions()
+        self.passes = 0
+        self.counts = {'full': 0, 'crops': 0, 'skipped': 0}
+
+    def __call__(self, frames):
+        raw = [None] * len(frames)
+        full = []
+        for i, frame in enumerate(frames):
+            regions = self.proposer(frame)
+            if regions is None or self.passes % self.full_frame_every == 0:
+                full.append(i)
+            else:
+                crops = region_crops(regions, self.frame_size, self.crop_size, self.max_zoom)
+                raw[i] = run_model_on_crops(self.model, frame, crops, self.device, self.transform, self.crop_size)
+                self.counts['crops' if len(crops) else 'skipped'] += 1
+            self.passes += 1
+        if full:
+            for i, result in zip(full, run_model(self.model, [frames[i] for i in full], self.device, self.transform)):
+                raw[i] = result
+            self.counts['full'] += len(full)
+        return raw
+
+
+def filter_birds(boxes, labels, scores, score_threshold=0.2):
+    """
+    Keeps the bird detections above score_threshold, as [x1, y1, x2, y2, score] rows for the tracker.
+    """
+    bird_indices = np.where((labels == BIRD_LABEL) & (scores > score_threshold))[0]
+    if len(bird_indices) > 0:
+        return np.hstack((boxes[bird_indices], scores[bird_indices].reshape(-1, 1)))
+    return np.empty((0, 5))
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DetectionCache(object):
+    """
+    Raw detections of every frame of one video, stored as concatenated boxes, labels and scores arrays plus
+    a per-frame offset index, like sort.load_detections. The cache directory is named after a hash of the
+    video content, the model name and the input resolution, so a change to any of them is a cache miss.
+    Detections made before FrameTensors fixed the channel order are keyed without ':rgb' and never reused.
+    """
+
+    def __init__(self, cache_dir, video_path, model_name, input_size):
+        key = '%s:%s:%dx%d:rgb' % (file_hash(video_path), model_name, input_size[0], input_size[1])
+        self.path = os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest()[:32])
+        self.boxes = self.labels = self.scores = self.offsets = None
+        self._pending = []
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'offsets.npy'))
+
+    def load(self):
+        """
+        Memory-maps a complete cache written by save.
+        """
+        for name in ('boxes', 'labels', 'scores'):
+            setattr(self, name, np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r'))
+        self.offsets = np.load(os.path.join(self.path, 'offsets.npy'))
+        return self
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.offsets is not None else len(self._pending)
+
+    def __getitem__(self, frame_index):
+        lo, hi = self.offsets[frame_index], self.offsets[frame_index + 1]
+        return np.asarray(self.boxes[lo:hi]), np.asarray(self.labels[lo:hi]), np.asarray(self.scores[lo:hi])
+
+    def append(self, boxes, labels, scores):
+        """
+        Records the raw detections of the next frame; call save once every frame has been appended.
+        """
+        self._pending.append((boxes, labels, scores))
+
+    def save(self):
+        counts = [len(boxes) for boxes, _, _ in self._pending]
+        arrays = {'boxes': np.concatenate([p[0] for p in self._pending] + [np.zeros((0, 4), np.float32)]),
+                  'labels': np.concatenate([p[1] for p in self._pending] + [np.zeros(0, np.int64)]),
+                  'scores': np.concatenate([p[2] for p in self._pending] + [np.zeros(0, np.float32)]),
+                  'offsets': np.concatenate(([0], np.cumsum(counts))).astype(np.int64)}
+        # Write into a temporary directory and rename it, so readers never see a partial cache
+        tmp_path = self.path + '.tmp%d' % os.getpid()
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # another run saved the same cache first
+            for name in arrays:
+                os.remove(os.path.join(tmp_path, name + '.npy'))
+            os.rmdir(tmp_path)
+        self._pending = []
@@ -0,0 +1,149 @@
+"""
+Benchmarks the bird detector inference profiles of bird_detector.py on the first frames of a video.
+
+    $ python detector_benchmark.py --input input.mp4 --frames 50 --threads 4
+    $ python detector_benchmark.py --input input.mp4 --conversion --batch_size 4
+
+Recall and precision are measured against the birds found by the reference profile, as there is no
+ground truth; the reference itself always scores 1.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import torch
+from torchvision import transforms
+
+from bird_detector import PROFILES, FrameTensors, filter_birds, load_model, run_model
+from sort import associate_detections_to_trackers
+
+
+def read_frames(path, count):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def benchmark_profile(frames, device, profile, threads=None, script_dir=None, batch_size=1, score_threshold=0.2):
+    """
+    Runs one profile over the frames. Returns the timings and the birds found in every frame.
+    """
+    start_time = time.perf_counter()
+    model = load_model(device, profile['model'], profile['input_size'], profile['quantize'], threads, script_dir)
+    load_time = time.perf_counter() - start_time
+    transform = FrameTensors(device)
+    run_model(model, frames[:1], device, transform)  # warm up
+
+    birds = []
+    start_time = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        for boxes, labels, scores in run_model(model, frames[i:i + batch_size], device, transform):
+            birds.append(filter_birds(boxes, labels, scores, score_threshold))
+    elapsed = time.perf_counter() - start_time
+    return {'load_s': load_time, 'fps': len(frames) / elapsed}, birds
+
+
+def benchmark_conversion(frames, device, batch_size=1, repeats=5):
+    """
+    Times the frame-to-tensor conversion alone, ToTensor frame by frame against FrameTensors batch by batch.
+    Returns the microseconds per frame of each.
+    """
+    to_tensor = transforms.ToTensor()
+    frame_tensors = FrameTensors(device)
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    timings = {}
+    for name, convert in (('to_tensor', lambda batch: [to_tensor(frame).to(device) for frame in batch]),
+                          ('frame_tensors', frame_tensors)):
+        convert(batches[0])  # warm up
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            for batch in batches:
+                convert(batch)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        timings[name + '_us'] = (time.perf_counter() - start_time) * 1e6 / (repeats * len(frames))
+    return timings
+
+
+def score_birds(birds, reference, iou_threshold=0.5):
+    """
+    Returns the recall and precision of birds against the reference detections, frame by frame.
+    """
+    matches = found = expected = 0
+    for dets, ref in zip(birds, reference):
+        matched, _, _ = associate_detections_to_trackers(dets, ref[:, :4], iou_threshold)
+        matches += len(matched)
+        found += len(dets)
+        expected += len(ref)
+    return {'recall': matches / float(expected) if expected else 1.,
+            'precision': matches / float(found) if found else 1.}
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Bird detector profile benchmark')
+    parser.add_argument("--input", help="Input video.", type=str, default='input.mp4')
+    parser.add_argument("--frames", help="Frames to detect per profile.", type=int, default=50)
+    parser.add_argument("--profiles", help="Profiles to compare.", type=str, nargs='+', choices=sorted(PROFILES),
+                        default=['accurate', 'balanced', 'fast', 'fastest'])
+    parser.add_argument("--reference", help="Profile whose detections count as ground truth.", type=str,
+                        choices=sorted(PROFILES), default='accurate')
+    parser.add_argument("--threads", help="Intra-op threads for the detector.", type=int, default=None)
+    parser.add_argument("--batch_size", help="Frames per inference batch.", type=int, default=1)
+    parser.add_argument("--score_threshold", help="Minimum detector score for a bird.", type=float, default=0.2)
+    parser.add_argument("--model_cache", help="Directory of prepared TorchScript models (default: none).",
+                        type=str, default=None)
+    parser.add_argument("--conversion", help="Only time the frame-to-tensor conversion.", action='store_true')
+    parser.add_argument("--json", help="Write the results to this file.", type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    frames = read_frames(args.input, args.frames)
+
+    if args.conversion:
+        result = benchmark_conversion(frames, device, args.batch_size)
+        print('%-14s %10s' % ('conversion', 'us/frame'))
+        print('%-14s %10.1f' % ('ToTensor', result['to_tensor_us']))
+        print('%-14s %10.1f' % ('FrameTensors', result['frame_tensors_us']))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+        sys.exit()
+
+    names = [args.reference] + [name for name in args.profiles if name != args.reference]
+    results = []
+    reference = None
+    for name in names:
+        profile = PROFILES[name]
+        result, birds = benchmark_profile(frames, device, profile, args.threads, args.model_cache, args.batch_size,
+                                          args.score_threshold)
+        if reference is None:
+            reference = birds
+        result.update(score_birds(birds, reference))
+        result.update(profile, profile=name, birds=int(sum(len(b) for b in birds)))
+        results.append(result)
+
+    print('%-9s %-38s %6s %5s %8s %8s %7s %7s %7s' % (
+        'profile', 'model', 'input', 'int8', 'load s', 'fps', 'birds', 'recall', 'prec'))
+    for r in results:
+        print('%-9s %-38s %6s %5s %8.2f %8.2f %7d %7.4f %7.4f' % (
+            r['profile'], r['model'], r['input_size'] or '-', 'yes' if r['quantize'] else 'no', r['load_s'],
+            r['fps'], r['birds'], r['recall'], r['precision']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': {'input': args.input, 'frames': len(frames), 'threads': args.threads,
+                                  'reference': args.reference}, 'results': results}, f, indent=2)
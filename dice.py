@@ -2,6 +2,37 @@ import pygame
 from pygame.locals import *
 from math import cos, sin, pi, sqrt
 import random
+import numpy as np
+
+
+def rotation_matrices(rx, ry, rz):
+    """
+    Returns the ...x3x3 matrices R = Rz Ry Rx for arrays of angles, so that R @ p rotates p like Die.rotate3d:
+    around x first, then y, then z.
+    """
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+    return np.stack((np.stack((cz * cy, cz * sy * sx - sz * cx, cz * sy * cx + sz * sx), axis=-1),
+                     np.stack((sz * cy, sz * sy * sx + cz * cx, sz * sy * cx - cz * sx), axis=-1),
+                     np.stack((-sy, cy * sx, cy * cx), axis=-1)), axis=-2)
+
+
+def project_dice(dice, center_x, center_y, f):
+    """
+    Rotates, moves and projects the vertices, pips and face normals of all the dice at once: one rotation
+    matrix per die and a few array operations for the lot, whatever the number of dice. Returns
+    (points, scales, normals): NxPx2 screen points and NxP perspective scales of each die's points (its
+    vertices followed by its pips), and Nx6x3 rotated face normals.
+    """
+    rotations = rotation_matrices(*np.array([(die.rx, die.ry, die.rz) for die in dice]).T)
+    world = (np.stack([die.points for die in dice]) @ rotations.transpose(0, 2, 1) +
+             np.array([die.position for die in dice], dtype=float)[:, None, :])
+    scales = f / (f + world[..., 2])
+    points = np.stack((center_x + world[..., 0] * scales, center_y - world[..., 1] * scales), axis=-1)
+    normals = np.stack([die.normals for die in dice]) @ rotations.transpose(0, 2, 1)
+    return points, scales, normals
+
 
 class Die:
     def __init__(self, cube_size, position=(0, 0, 0)):
@@ -61,6 +92,18 @@ class Die:
             [(0.25, 0.25), (0.25, 0.5), (0.25, 0.75), (0.75, 0.25), (0.75, 0.5), (0.75, 0.75)]  # 6
         ]
 
+        # The same geometry as arrays for project_dice: the vertices followed by the pips of every face in
+        # face order, with the rows of each face's pips, and the normals
+        pips = []
+        self.pip_rows = []
+        for face, num in zip(self.faces, self.face_numbers):
+            pa, pb, pd = (np.array(self.vertices[k], dtype=float) for k in (face[0], face[1], face[3]))
+            start = len(self.vertices) + len(pips)
+            pips.extend(pa + u * (pb - pa) + v * (pd - pa) for u, v in self.dot_positions[num - 1])
+            self.pip_rows.append(range(start, len(self.vertices) + len(pips)))
+        self.points = np.vstack((np.array(self.vertices, dtype=float), pips))
+        self.normals = np.array(self.face_normals, dtype=float)
+
     def rotate3d(self, point, rx, ry, rz):
         x, y, z = point
         # Rotate around x
@@ -142,49 +185,19 @@ class Die:
         return min_x, min_y, max_x, max_y
 
     def draw(self, screen, center_x, center_y, f):
-        # Rotate vertices
-        rotated_vertices = []
-        for v in self.vertices:
-            rv = self.rotate3d(v, self.rx, self.ry, self.rz)
-            rv = (rv[0] + self.position[0], rv[1] + self.position[1], rv[2] + self.position[2])
-            rotated_vertices.append(rv)
-
-        # Draw faces
+        points, scales, normals = project_dice([self], center_x, center_y, f)
+        self.draw_projected(screen, points[0], scales[0], normals[0])
+
+    def draw_projected(self, screen, points, scales, normals):
+        # Draw the die from its row of project_dice's output
+        points = points.tolist()
         for i, face in enumerate(self.faces):
-            v1 = rotated_vertices[face[0]]
-            v2 = rotated_vertices[face[1]]
-            v3 = rotated_vertices[face[2]]
-            normal = self.get_rotated_normal(self.face_normals[i], self.rx, self.ry, self.rz)
-            if normal[2] > 0:  # Simple backface culling
-                proj_points = []
-                for vi in face:
-                    rx, ry, rz = rotated_vertices[vi]
-                    scale = f / (f + rz)
-                    x_proj = center_x + rx * scale
-                    y_proj = center_y - ry * scale  # Flip y for positive up
-                    proj_points.append((x_proj, y_proj))
-                pygame.draw.polygon(screen, (255, 255, 255), proj_points)
+            if normals[i][2] > 0:  # Simple backface culling
+                pygame.draw.polygon(screen, (255, 255, 255), [points[vi] for vi in face])
 
                 # Draw dots
-                num = self.face_numbers[i]
-                dots = self.dot_positions[num - 1]
-                # Get basis for face
-                pa = self.vertices[face[0]]
-                pb = self.vertices[face[1]]
-                pd = self.vertices[face[3]]
-                u_vec = (pb[0] - pa[0], pb[1] - pa[1], pb[2] - pa[2])
-                v_vec = (pd[0] - pa[0], pd[1] - pa[1], pd[2] - pa[2])
-                for u, v in dots:
-                    local = (pa[0] + u * u_vec[0] + v * v_vec[0],
-                             pa[1] + u * u_vec[1] + v * v_vec[1],
-                             pa[2] + u * u_vec[2] + v * v_vec[2])
-                    rdot = self.rotate3d(local, self.rx, self.ry, self.rz)
-                    rdot = (rdot[0] + self.position[0], rdot[1] + self.position[1], rdot[2] + self.position[2])
-                    scale = f / (f + rdot[2])
-                    x_proj = center_x + rdot[0] * scale
-                    y_proj = center_y - rdot[1] * scale
-                    dot_radius = 0.1 * self.cube_size * scale
-                    pygame.draw.circle(screen, (0, 0, 0), (x_proj, y_proj), dot_radius)
+                for k in self.pip_rows[i]:
+                    pygame.draw.circle(screen, (0, 0, 0), points[k], 0.1 * self.cube_size * scales[k])
 
     def get_top_face(self):
         max_y = -float('inf')
@@ -263,7 +276,9 @@ def main():
 
         for die in dice:
             die.update(dt, bounds)
-            die.draw(screen, center_x, center_y, f)
+        points, scales, normals = project_dice(dice, center_x, center_y, f)
+        for i, die in enumerate(dice):
+            die.draw_projected(screen, points[i], scales[i], normals[i])
             if die.stopped:
                 result = die.get_top_face()
                 text = font.render(str(result), True, (255, 0, 0))
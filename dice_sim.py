@@ -0,0 +1,192 @@
+"""
+Headless Monte Carlo throws for dice.py: the physics of Die.update, ported to arrays so that a step
+moves every die at once, run with a fixed timestep and seeded randomness, without pygame or a display.
+
+    $ python dice_sim.py --throws 1000000 --workers 4 --seed 0
+
+Each throw releases a die above a random spot on the floor with a random orientation, flick and spin,
+as a mouse throw in dice.py does, and runs until the die comes to rest or --duration runs out. The result
+of a throw is the top face when the die first comes to rest, as dice.py shows it, or at the end of the
+throw if it never does. Throws are simulated in chunks, each seeded from --seed and its index, so the
+results do not depend on the number of workers.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Faces as in Die: front, right, back, left, top, bottom, and the y component of each rotated face normal
+# as +-row 1 of the rotation matrix, which is all get_top_face compares
+FACE_NUMBERS = np.array([2, 4, 5, 3, 1, 6])
+NORMAL_AXES = np.array([2, 0, 2, 0, 1, 1])
+NORMAL_SIGNS = np.array([-1, 1, 1, -1, 1, -1])
+
+
+def top_faces(angles):
+    """
+    Returns the number on the top face of dice at Nx3 (rx, ry, rz) angles, like Die.get_top_face.
+    """
+    cx, sx = np.cos(angles[:, 0]), np.sin(angles[:, 0])
+    cy, sy = np.cos(angles[:, 1]), np.sin(angles[:, 1])
+    cz, sz = np.cos(angles[:, 2]), np.sin(angles[:, 2])
+    # row 1 of R = Rz Ry Rx, the rotation Die.rotate3d applies
+    up = np.stack((sz * cy, sz * sy * sx + cz * cx, sz * sy * cx - cz * sx), axis=1)
+    return FACE_NUMBERS[np.argmax(up[:, NORMAL_AXES] * NORMAL_SIGNS, axis=1)]
+
+
+def simulate(count, seed, dt=1 / 60., duration=10., cube_size=50, bounds=(300, 300), height=100, throw_speed=10.):
+    """
+    Throws count dice and steps them together by dt, with the same updates as Die.update, until all have
+    come to rest or duration is up. Returns (faces, settle_times): the result of every throw, and the time
+    each die came to rest, inf for those that did not.
+    """
+    rng = np.random.default_rng(seed)
+    s = cube_size
+    limits = np.array([bounds[0] - s, bounds[1] - s], dtype=float)
+    position = np.column_stack((rng.uniform(-limits[0], limits[0], count), np.full(count, s + height, dtype=float),
+                                rng.uniform(-limits[1], limits[1], count)))
+    velocity = np.column_stack((rng.uniform(-throw_speed, throw_speed, count), np.full(count, 20.),
+                                rng.uniform(-throw_speed, throw_speed, count)))
+    angles = rng.uniform(0, 2 * np.pi, (count, 3))
+    angular_velocity = rng.uniform(-10, 10, (count, 3))
+    stopped = np.zeros(count, dtype=bool)
+    settle_times = np.full(count, np.inf)
+    faces = np.zeros(count, dtype=int)
+
+    t = 0.
+    for _ in range(int(round(duration / dt))):
+        t += dt
+        # Gravity and velocity
+        velocity[:, 1] -= 9.81 * dt * 10  # Scaled gravity
+        position += velocity * dt
+        angles += angular_velocity * dt
+
+        # Bounce on floor, with a new random spin
+        floor = position[:, 1] <= s
+        position[floor, 1] = s
+        velocity[floor, 1] = -velocity[floor, 1] * 0.7
+        velocity[floor, 0] *= 0.95
+        velocity[floor, 2] *= 0.95
+        angular_velocity[floor] = rng.uniform(-10, 10, (np.count_nonzero(floor), 3))
+
+        # Friction if on floor
+        on_floor = position[:, 1] == s
+        velocity[on_floor, 0] *= 0.98
+        velocity[on_floor, 2] *= 0.98
+        angular_velocity[on_floor] *= 0.98
+
+        # Wall bounces
+        for axis, limit in zip((0, 2), limits):
+            wall = np.abs(position[:, axis]) > limit
+            velocity[wall, axis] = -velocity[wall, axis] * 0.8
+            position[wall, axis] = limit * np.where(position[wall, axis] > 0, 1, -1)
+
+        # Check if stopped; a die keeps being updated afterwards, as in dice.py
+        rest = ((np.sqrt((velocity ** 2).sum(axis=1)) < 0.1) & (np.sqrt((angular_velocity ** 2).sum(axis=1)) < 0.1) &
+                on_floor)
+        velocity[rest] = 0
+        angular_velocity[rest] = 0
+        settled = rest & ~stopped
+        settle_times[settled] = t
+        faces[settled] = top_faces(angles[settled])
+        stopped |= rest
+        if stopped.all():
+            break
+    faces[~stopped] = top_faces(angles[~stopped])
+    return faces, settle_times
+
+
+def simulate_chunk(args):
+    index, count, seed, kwargs = args
+    return simulate(count, [seed, index], **kwargs)
+
+
+def run(throws, seed=0, workers=None, chunk_size=50000, **kwargs):
+    """
+    Simulates throws dice in chunks of chunk_size on a pool of worker processes. Returns the concatenated
+    (faces, settle_times) of simulate.
+    """
+    counts = [min(chunk_size, throws - start) for start in range(0, throws, chunk_size)]
+    jobs = [(i, count, seed, kwargs) for i, count in enumerate(counts)]
+    if workers == 1:
+        results = list(map(simulate_chunk, jobs))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(simulate_chunk, jobs))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def fairness(faces):
+    """
+    Returns the count and frequency of every face, the chi-square statistic and p-value of the counts
+    against a fair die, and the largest deviation of a frequency from 1/6.
+    """
+    from scipy.stats import chisquare
+    counts = np.bincount(faces, minlength=7)[1:]
+    frequencies = counts / float(len(faces))
+    chi2, p_value = chisquare(counts)
+    return {'counts': counts.tolist(), 'frequencies': frequencies.tolist(), 'chi2': float(chi2),
+            'p_value': float(p_value), 'max_deviation': float(np.abs(frequencies - 1 / 6.).max())}
+
+
+def settling(settle_times):
+    """
+    Returns the fraction of dice that came to rest and the mean and quantiles of their settle times.
+    """
+    rested = settle_times[np.isfinite(settle_times)]
+    stats = {'rested': len(rested) / float(len(settle_times))}
+    if len(rested):
+        stats.update(mean_s=float(rested.mean()), median_s=float(np.median(rested)),
+                     p95_s=float(np.percentile(rested, 95)), max_s=float(rested.max()))
+    return stats
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Headless Monte Carlo dice throws')
+    parser.add_argument("--throws", help="Dice to throw.", type=int, default=100000)
+    parser.add_argument("--seed", help="Seed of the random throws.", type=int, default=0)
+    parser.add_argument("--workers", help="Worker processes (default: one per CPU).", type=int, default=None)
+    parser.add_argument("--chunk_size", help="Dice simulated together by one worker.", type=int, default=50000)
+    parser.add_argument("--dt", help="Fixed timestep in seconds (dice.py runs at 60 fps).", type=float,
+                        default=1 / 60.)
+    parser.add_argument("--duration", help="Longest throw in seconds.", type=float, default=10.)
+    parser.add_argument("--cube_size", help="Half the edge of a die.", type=float, default=50)
+    parser.add_argument("--bounds", help="Half the floor's size in x and z.", type=float, nargs=2, default=[300, 300])
+    parser.add_argument("--height", help="Release height of a throw above a resting die.", type=float, default=100)
+    parser.add_argument("--throw_speed", help="Largest horizontal speed of a throw.", type=float, default=10.)
+    parser.add_argument("--json", help="Write the results to this file.", type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    workers = args.workers or os.cpu_count()
+    start_time = time.perf_counter()
+    faces, settle_times = run(args.throws, args.seed, workers, args.chunk_size, dt=args.dt, duration=args.duration,
+                              cube_size=args.cube_size, bounds=tuple(args.bounds), height=args.height,
+                              throw_speed=args.throw_speed)
+    elapsed = time.perf_counter() - start_time
+    fair = fairness(faces)
+    settle = settling(settle_times)
+
+    print('%d throws in %.2f s (%.0f throws/s, %d workers)' % (args.throws, elapsed, args.throws / elapsed, workers))
+    print('%4s %10s %9s' % ('face', 'count', 'freq'))
+    for face, (count, frequency) in enumerate(zip(fair['counts'], fair['frequencies']), 1):
+        print('%4d %10d %9.5f' % (face, count, frequency))
+    print('chi2 %.2f (5 dof), p = %.4f, largest deviation from 1/6 %.5f' % (fair['chi2'], fair['p_value'],
+                                                                            fair['max_deviation']))
+    if 'mean_s' in settle:
+        print('came to rest: %.2f%%, settle time mean %.2f s, median %.2f s, p95 %.2f s, max %.2f s' % (
+            100 * settle['rested'], settle['mean_s'], settle['median_s'], settle['p95_s'], settle['max_s']))
+    else:
+        print('came to rest: none within %g s; the faces are those at the end of the throws' % args.duration)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'seconds': elapsed, 'fairness': fair, 'settling': settle}, f, indent=2)
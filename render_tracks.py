@@ -0,0 +1,89 @@
+"""
+Draws a saved track file onto its video, for runs of track_birds.py or track_birds2.py made with --no_video.
+
+    $ python track_birds2.py --input input.mp4 --no_video --tracks tracks.bin
+    $ python render_tracks.py --input input.mp4 --tracks tracks.bin --output output.mp4
+
+Decoding and encoding run on their own threads, so rendering costs little more than copying the video.
+"""
+import argparse
+import os
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from track_io import read_tracks
+from video_io import VideoReader, VideoWriter
+
+
+def draw_tracks(frame, tracked_objects):
+    # Draw orange circles for each tracked bird
+    for obj in tracked_objects:
+        x1, y1, x2, y2, track_id = obj
+        center_x = (x1 + x2) / 2
+        center_y = (y1 + y2) / 2
+        w = x2 - x1
+        h = y2 - y1
+        radius = np.sqrt((w / 2) ** 2 + (h / 2) ** 2)
+        cv2.circle(frame, (int(center_x), int(center_y)), int(radius), (0, 165, 255), 2)
+
+
+def draw_circles(frame, boxes):
+    # Draw green circles around the (x, y, w, h) boxes of the CSRT trackers
+    for x, y, w, h in boxes:
+        center = (x + w // 2, y + h // 2)
+        radius = max(w, h) // 2 + 5
+        cv2.circle(frame, center, radius, (0, 255, 0), 2)
+
+
+def draw_rows(frame, rows, style):
+    """
+    Draws [frame, id, x, y, w, h] track rows the way the tracker that wrote them does: 'sort' for
+    track_birds2.py, 'csrt' for track_birds.py.
+    """
+    if style == 'csrt':
+        draw_circles(frame, rows[:, 2:6].astype(int))
+    else:
+        draw_tracks(frame, np.column_stack((rows[:, 2:4], rows[:, 2:4] + rows[:, 4:6], rows[:, 1])))
+
+
+def render(input_path, tracks_path, output_path, style='sort', fourcc=None, queue_size=16):
+    """
+    Writes the input video with the tracks of tracks_path drawn on it. The codec defaults to MJPG for .avi
+    outputs, as track_birds.py writes, and to mp4v otherwise.
+    """
+    rows = read_tracks(tracks_path)
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    if fourcc is None:
+        fourcc = 'MJPG' if os.path.splitext(output_path)[1].lower() == '.avi' else 'mp4v'
+    reader = VideoReader(input_path, prefetch=queue_size)
+    out = VideoWriter(output_path, fourcc, reader.fps, reader.size, queue_size=queue_size)
+    frame_number = 1  # MOT frames count from 1
+    for frame in tqdm(reader, total=reader.frame_count, desc='render'):
+        lo, hi = np.searchsorted(rows[:, 0], [frame_number, frame_number + 1])
+        draw_rows(frame, rows[lo:hi], style)
+        out.write(frame)
+        frame_number += 1
+    reader.release()
+    out.release()
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Draw a saved track file onto its video')
+    parser.add_argument("--input", help="Input video the tracks were found in.", type=str, default='input.mp4')
+    parser.add_argument("--tracks", help="MOT text or .bin track file.", type=str, default='output.txt')
+    parser.add_argument("--output", help="Annotated output video.", type=str, default='output.mp4')
+    parser.add_argument("--style", help="Draw like track_birds2.py (sort) or track_birds.py (csrt).", type=str,
+                        choices=['sort', 'csrt'], default='sort')
+    parser.add_argument("--fourcc", help="Output codec (default: MJPG for .avi, else mp4v).", type=str, default=None)
+    parser.add_argument("--queue_size", help="Frames buffered for decoding and encoding.", type=int, default=16)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    render(args.input, args.tracks, args.output, args.style, args.fourcc, args.queue_size)
+    print(f'Output saved to {args.output}')
@@ -19,30 +19,72 @@ from __future__ import print_function
 
 import os
 import numpy as np
-import matplotlib
-
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from skimage import io
 
 import glob
+import json
+import math
 import time
 import argparse
-from filterpy.kalman import KalmanFilter
+from concurrent.futures import ProcessPoolExecutor
 
 np.random.seed(0)
 
 
-def linear_assignment(cost_matrix):
-    try:
-        import lap
-        _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-        return np.array([[y[i], i] for i in x if i >= 0])  #
-    except ImportError:
-        from scipy.optimize import linear_sum_assignment
-        x, y = linear_sum_assignment(cost_matrix)
-        return np.array(list(zip(x, y)))
+try:
+    import lap
+except ImportError:
+    lap = None
+
+
+def lap_assignment(cost_matrix):
+    _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
+    cols = x[x >= 0]
+    return np.stack((y[cols], cols), axis=1)
+
+
+def scipy_assignment(cost_matrix):
+    from scipy.optimize import linear_sum_assignment
+    x, y = linear_sum_assignment(cost_matrix)
+    return np.stack((x, y), axis=1)
+
+
+def greedy_assignment(cost_matrix):
+    """
+    Greedy matcher for very large frames: repeatedly takes every pair that is the cheapest entry of
+      both its row and its column, which gives the same matching as taking pairs in order of
+      increasing cost. Only negative costs (overlapping boxes for a -IOU cost) are matched.
+    """
+    rows, cols = np.nonzero(cost_matrix < 0)
+    cost = cost_matrix[rows, cols]
+    order = np.argsort(cost, kind='stable')
+    rows, cols = rows[order], cols[order]
+    matched = [np.empty((0, 2), dtype=int)]
+    while len(rows):
+        # entries are sorted by cost, so the first entry of each row and column is its cheapest
+        row_best = np.zeros(len(rows), dtype=bool)
+        row_best[np.unique(rows, return_index=True)[1]] = True
+        col_best = np.zeros(len(cols), dtype=bool)
+        col_best[np.unique(cols, return_index=True)[1]] = True
+        mutual = row_best & col_best
+        matched.append(np.stack((rows[mutual], cols[mutual]), axis=1))
+        row_taken = np.zeros(cost_matrix.shape[0], dtype=bool)
+        row_taken[rows[mutual]] = True
+        col_taken = np.zeros(cost_matrix.shape[1], dtype=bool)
+        col_taken[cols[mutual]] = True
+        free = ~(row_taken[rows] | col_taken[cols])
+        rows, cols = rows[free], cols[free]
+    return np.concatenate(matched)
+
+
+# assignment backends, resolved once at import; 'lap' is only available when lap is installed
+ASSIGNMENT_SOLVERS = {'scipy': scipy_assignment, 'greedy': greedy_assignment}
+if lap is not None:
+    ASSIGNMENT_SOLVERS['lap'] = lap_assignment
+DEFAULT_SOLVER = 'lap' if lap is not None else 'scipy'
+
+
+def linear_assignment(cost_matrix, solver=None):
+    return ASSIGNMENT_SOLVERS[solver or DEFAULT_SOLVER](cost_matrix)
 
 
 def iou_batch(bb_test, bb_gt):
@@ -92,6 +134,27 @@ def convert_x_to_bbox(x, score=None):
         return np.array([x[0] - w / 2., x[1] - h / 2., x[0] + w / 2., x[1] + h / 2., score]).reshape((1, 5))
 
 
+def convert_bboxes_to_z(bboxes):
+    """
+    Batched convert_bbox_to_z: takes an array of bounding boxes in the form [[x1,y1,x2,y2,...],...]
+      and returns an Nx4 array of [x,y,s,r] rows
+    """
+    bboxes = np.asarray(bboxes, dtype=float)
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    return np.stack((bboxes[:, 0] + w / 2., bboxes[:, 1] + h / 2., w * h, w / h), axis=1)
+
+
+def convert_x_to_bboxes(x):
+    """
+    Batched convert_x_to_bbox: takes an array of states [[x,y,s,r,...],...] and returns an Nx4
+      array of [x1,y1,x2,y2] rows
+    """
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+    return np.stack((x[:, 0] - w / 2., x[:, 1] - h / 2., x[:, 0] + w / 2., x[:, 1] + h / 2.), axis=1)
+
+
 class KalmanBoxTracker(object):
     """
     This class represents the internal state of individual tracked objects observed as bbox.
@@ -102,6 +165,8 @@ class KalmanBoxTracker(object):
         """
         Initialises a tracker using initial bounding box.
         """
+        from filterpy.kalman import KalmanFilter  # only the per-object tracker needs filterpy, which is slow to import
+
         # define constant velocity model
         self.kf = KalmanFilter(dim_x=7, dim_z=4)
         self.kf.F = np.array(
@@ -156,61 +221,526 @@ class KalmanBoxTracker(object):
         return convert_x_to_bbox(self.kf.x)
 
 
-def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
+class KalmanBoxBank(object):
+    """
+    This class holds the internal state of every tracked object as struct-of-arrays (an Nx7 state
+    matrix and an Nx7x7 covariance stack), so that predict and update run as one batched operation
+    over all tracks. It uses the same constant velocity model as KalmanBoxTracker.
+    """
+    F = np.array(
+        [[1, 0, 0, 0, 1, 0, 0], [0, 1, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0, 1], [0, 0, 0, 1, 0, 0, 0],
+         [0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 1]], dtype=float)
+    H = np.array(
+        [[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0], [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]], dtype=float)
+    R = np.diag([1., 1., 10., 10.])
+    Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+    P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+
+    # per-track arrays, all indexed by track position
+    columns = ('x', 'P', 'ids', 'streams', 'scores', 'time_since_update', 'hits', 'hit_streak', 'age')
+
+    def __init__(self):
+        self.x = np.zeros((0, 7))
+        self.P = np.zeros((0, 7, 7))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.streams = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0)
+        self.time_since_update = np.zeros(0, dtype=np.int64)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.hit_streak = np.zeros(0, dtype=np.int64)
+        self.age = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.x)
+
+    def add(self, bboxes, ids=None, streams=0):
+        """
+        Initialises one track per bounding box [x1,y1,x2,y2,score]. IDs are drawn from KalmanBoxTracker.count
+          unless given.
+        """
+        n = len(bboxes)
+        if n == 0:
+            return
+        if ids is None:
+            ids = np.arange(KalmanBoxTracker.count, KalmanBoxTracker.count + n, dtype=np.int64)
+            KalmanBoxTracker.count += n
+        new = {'x': np.zeros((n, 7)), 'P': np.broadcast_to(self.P0, (n, 7, 7)), 'ids': ids,
+               'streams': np.broadcast_to(streams, (n,)), 'scores': bboxes[:, 4] if bboxes.shape[1] > 4 else np.ones(n)}
+        new['x'][:, :4] = convert_bboxes_to_z(bboxes)
+        for name in self.columns:
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate((column, new.get(name, np.zeros((n,) + column.shape[1:], column.dtype)))))
+
+    def keep(self, mask):
+        """
+        Drops every track whose entry in the boolean mask is False.
+        """
+        for name in self.columns:
+            setattr(self, name, getattr(self, name)[mask])
+
+    def predict(self, advance_counters=True):
+        """
+        Advances every state vector and returns the Nx4 predicted bounding box estimates. With
+          advance_counters=False the tracks are moved without being aged.
+        """
+        self.x[(self.x[:, 6] + self.x[:, 2]) <= 0, 6] = 0.
+        self.x = self.x @ self.F.T
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        if not advance_counters:
+            return self.get_state()
+        self.age += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+        return self.get_state()
+
+    def update(self, idx, bboxes):
+        """
+        Updates the tracks at positions idx with the observed bounding boxes.
+        """
+        if len(idx) == 0:
+            return
+        self.time_since_update[idx] = 0
+        if bboxes.shape[1] > 4:
+            self.scores[idx] = bboxes[:, 4]
+        self.hits[idx] += 1
+        self.hit_streak[idx] += 1
+
+        x = self.x[idx]
+        P = self.P[idx]
+        y = convert_bboxes_to_z(bboxes) - x[:, :4]
+        PHT = P[:, :, :4]
+        S = P[:, :4, :4] + self.R
+        K = np.linalg.solve(S, PHT.transpose(0, 2, 1)).transpose(0, 2, 1)
+        I_KH = np.eye(7) - K @ self.H
+        self.x[idx] = x + (K @ y[:, :, None])[:, :, 0]
+        # Joseph form, as used by filterpy
+        self.P[idx] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+
+    def get_state(self):
+        """
+        Returns the Nx4 current bounding box estimates.
+        """
+        return convert_x_to_bboxes(self.x)
+
+
+def overlap_candidates(bb_test, bb_gt, test_groups=None, gt_groups=None):
+    """
+    Sorted-interval prefilter: returns the index pairs (test, gt) of boxes in the form [x1,y1,x2,y2]
+      that overlap, without building the full len(bb_test) x len(bb_gt) matrix.
+      With test_groups and gt_groups (one integer per box) only boxes of the same group are paired.
+    """
+    if len(bb_test) == 0 or len(bb_gt) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    max_w = np.max(bb_gt[:, 2] - bb_gt[:, 0])
+    gt_key = bb_gt[:, 0]
+    test_lo, test_hi = bb_test[:, 0], bb_test[:, 2]
+    if test_groups is not None:
+        # lay the groups out side by side along x, far enough apart that they can never overlap
+        span = max(bb_gt[:, 2].max(), bb_test[:, 2].max()) - min(bb_gt[:, 0].min(), bb_test[:, 0].min()) + max_w + 1.
+        gt_key = gt_key + gt_groups * span
+        test_lo = test_lo + test_groups * span
+        test_hi = test_hi + test_groups * span
+    order = np.argsort(gt_key, kind='stable')
+    gt_x1 = gt_key[order]
+    # any gt box with x2 > test x1 has x1 > test x1 - max_w
+    lo = np.searchsorted(gt_x1, test_lo - max_w, side='right')
+    hi = np.searchsorted(gt_x1, test_hi, side='left')
+    counts = np.maximum(hi - lo, 0)
+    test_idx = np.repeat(np.arange(len(bb_test)), counts)
+    starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    gt_idx = order[starts + np.arange(len(test_idx))]
+    overlap = ((bb_gt[gt_idx, 2] > bb_test[test_idx, 0]) & (bb_gt[gt_idx, 1] < bb_test[test_idx, 3])
+               & (bb_gt[gt_idx, 3] > bb_test[test_idx, 1]))
+    return test_idx[overlap], gt_idx[overlap]
+
+
+def iou_pairs(bb_test, bb_gt, test_idx, gt_idx):
+    """
+    Computes IOU between bb_test[test_idx[k]] and bb_gt[gt_idx[k]] for every k
+    """
+    a = bb_test[test_idx]
+    b = bb_gt[gt_idx]
+    w = np.maximum(0., np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]))
+    h = np.maximum(0., np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]))
+    wh = w * h
+    return wh / ((a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - wh)
+
+
+def sparse_linear_assignment(rows, cols, cost, shape, solver=None):
+    """
+    Solves the assignment problem for a sparse cost matrix given as (rows, cols, cost) triplets.
+      The bipartite graph is split into connected components, and each block of the resulting
+      block-diagonal matrix is solved on its own.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if len(rows) == 0:
+        return np.empty((0, 2), dtype=int)
+    n_rows, n_cols = shape
+    graph = coo_matrix((np.ones(len(rows)), (rows, cols + n_rows)), shape=(n_rows + n_cols,) * 2)
+    n_blocks, labels = connected_components(graph, directed=False)
+    # number the rows and columns of each block from zero
+    row_order = np.argsort(labels[:n_rows], kind='stable')
+    row_start = np.searchsorted(labels[:n_rows][row_order], np.arange(n_blocks))
+    local_rows = np.empty(n_rows, dtype=int)
+    local_rows[row_order] = np.arange(n_rows) - row_start[labels[:n_rows][row_order]]
+    col_order = np.argsort(labels[n_rows:], kind='stable')
+    col_start = np.searchsorted(labels[n_rows:][col_order], np.arange(n_blocks))
+    local_cols = np.empty(n_cols, dtype=int)
+    local_cols[col_order] = np.arange(n_cols) - col_start[labels[n_rows:][col_order]]
+    block_rows = np.bincount(labels[:n_rows], minlength=n_blocks)
+    block_cols = np.bincount(labels[n_rows:], minlength=n_blocks)
+
+    pair_labels = labels[rows]
+    order = np.lexsort((cost, pair_labels))
+    block_labels, starts, sizes = np.unique(pair_labels[order], return_index=True, return_counts=True)
+
+    # a block with a single row or a single column is solved by its cheapest pair
+    star = (block_rows[block_labels] == 1) | (block_cols[block_labels] == 1)
+    cheapest = order[starts[star]]
+    matched = [np.stack((rows[cheapest], cols[cheapest]), axis=1)]
+    for label, start, size in zip(block_labels[~star], starts[~star], sizes[~star]):
+        block = order[start:start + size]
+        block_cost = np.zeros((block_rows[label], block_cols[label]))
+        block_cost[local_rows[rows[block]], local_cols[cols[block]]] = cost[block]
+        m = linear_assignment(block_cost, solver).reshape(-1, 2)
+        matched.append(np.stack((row_order[row_start[label] + m[:, 0]], col_order[col_start[label] + m[:, 1]]), axis=1))
+    return np.concatenate(matched).astype(int)
+
+
+def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3, sparse=False, solver=None,
+                                     det_groups=None, trk_groups=None, stats=None):
     """
     Assigns detections to tracked object (both represented as bounding boxes)
 
+    With sparse=True only box pairs that can overlap are scored, and the assignment is solved on the
+    resulting sparse cost matrix, so the cost grows with the number of overlaps instead of N*M.
+    solver names one of ASSIGNMENT_SOLVERS and defaults to DEFAULT_SOLVER.
+    det_groups and trk_groups optionally give a group (stream) per box; only boxes of the same group are
+    matched, which implies sparse=True.
+    stats is an optional SortStats that receives the time spent on IOU and on assignment.
+
     Returns 3 lists of matches, unmatched_detections and unmatched_trackers
     """
     if (len(trackers) == 0):
-        return np.empty((0, 2), dtype=int), np.arange(len(detections)), np.empty((0, 5), dtype=int)
+        return np.empty((0, 2), dtype=int), np.arange(len(detections)), np.empty(0, dtype=int)
 
-    iou_matrix = iou_batch(detections, trackers)
-
-    if min(iou_matrix.shape) > 0:
-        a = (iou_matrix > iou_threshold).astype(np.int32)
-        if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-            matched_indices = np.stack(np.where(a), axis=1)
+    if stats is not None:
+        start_time = time.perf_counter()
+    if sparse or det_groups is not None:
+        d, t = overlap_candidates(detections, trackers, det_groups, trk_groups)
+        iou = iou_pairs(detections, trackers, d, t)
+        if stats is not None:
+            start_time = stats.lap('iou', start_time)
+        above = iou > iou_threshold
+        if det_groups is None:
+            fast = np.full(len(d), above.any() and np.bincount(d[above]).max() == 1 and
+                           np.bincount(t[above]).max() == 1)
         else:
-            matched_indices = linear_assignment(-iou_matrix)
+            # decide for every group on its own, as a call with only that group's boxes would
+            n_groups = int(max(det_groups.max(initial=-1), trk_groups.max(initial=-1))) + 1
+            shared = np.zeros(n_groups, dtype=bool)
+            shared[det_groups[np.bincount(d[above], minlength=len(detections)) > 1]] = True
+            shared[trk_groups[np.bincount(t[above], minlength=len(trackers)) > 1]] = True
+            fast = ((np.bincount(det_groups[d[above]], minlength=n_groups) > 0) & ~shared)[det_groups[d]]
+        # groups where every box has at most one candidate above the threshold are matched directly
+        matched_indices = np.concatenate((
+            np.stack((d[fast & above], t[fast & above]), axis=1),
+            sparse_linear_assignment(d[~fast], t[~fast], -iou[~fast], (len(detections), len(trackers)), solver)))
+        matched_iou = iou_pairs(detections, trackers, matched_indices[:, 0], matched_indices[:, 1])
     else:
-        matched_indices = np.empty(shape=(0, 2))
+        iou_matrix = iou_batch(detections, trackers)
+        if stats is not None:
+            start_time = stats.lap('iou', start_time)
+
+        if min(iou_matrix.shape) > 0:
+            a = (iou_matrix > iou_threshold).astype(np.int32)
+            if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+                matched_indices = np.stack(np.where(a), axis=1)
+            else:
+                matched_indices = linear_assignment(-iou_matrix, solver)
+        else:
+            matched_indices = np.empty(shape=(0, 2))
+        matched_indices = matched_indices.reshape(-1, 2).astype(int)
+        matched_iou = iou_matrix[matched_indices[:, 0], matched_indices[:, 1]]
 
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if (d not in matched_indices[:, 0]):
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if (t not in matched_indices[:, 1]):
-            unmatched_trackers.append(t)
+    unmatched_detections = np.ones(len(detections), dtype=bool)
+    unmatched_detections[matched_indices[:, 0]] = False
+    unmatched_trackers = np.ones(len(trackers), dtype=bool)
+    unmatched_trackers[matched_indices[:, 1]] = False
 
     # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if (iou_matrix[m[0], m[1]] < iou_threshold):
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if (len(matches) == 0):
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
+    low = matched_iou < iou_threshold
+    matches = matched_indices[~low]
+    unmatched_detections = np.concatenate((np.flatnonzero(unmatched_detections), matched_indices[low, 0]))
+    unmatched_trackers = np.concatenate((np.flatnonzero(unmatched_trackers), matched_indices[low, 1]))
+    if stats is not None:
+        stats.lap('assignment', start_time)
+
+    return matches, unmatched_detections, unmatched_trackers
+
+
+class SortStats(object):
+    """
+    Per-stage timers and per-frame counters for Sort.update. Every value goes into a fixed-size
+    histogram (log-spaced bins from 1us to 10s for times, power-of-two bins for counts), so memory
+    stays constant however long the run.
+    """
+    stages = ('predict', 'iou', 'assignment', 'update', 'output', 'prune')
+    counters = ('tracks', 'detections', 'matches', 'births', 'deaths')
+    bins_per_decade = 10
+    time_bins = np.logspace(-6, 1, 7 * bins_per_decade + 1)  # upper edges; the last bin is open
+    count_bins = 2 ** np.arange(33)  # bin k holds values below 2**k
+
+    def __init__(self):
+        self.frames = 0
+        self.time_hist = {stage: np.zeros(len(self.time_bins) + 1, dtype=np.int64) for stage in self.stages}
+        self.time_total = dict.fromkeys(self.stages, 0.)
+        self.time_max = dict.fromkeys(self.stages, 0.)
+        self.count_hist = {name: np.zeros(len(self.count_bins) + 1, dtype=np.int64) for name in self.counters}
+        self.count_total = dict.fromkeys(self.counters, 0)
+        self.count_max = dict.fromkeys(self.counters, 0)
+
+    def add_time(self, stage, seconds):
+        b = int(math.ceil((math.log10(seconds) + 6) * self.bins_per_decade)) if seconds > 1e-6 else 0
+        self.time_hist[stage][min(b, len(self.time_bins))] += 1
+        self.time_total[stage] += seconds
+        if seconds > self.time_max[stage]:
+            self.time_max[stage] = seconds
+
+    def lap(self, stage, start_time):
+        """
+        Records the time since start_time against stage and returns the current time.
+        """
+        now = time.perf_counter()
+        self.add_time(stage, now - start_time)
+        return now
+
+    def add_count(self, name, value):
+        value = int(value)
+        self.count_hist[name][min(value.bit_length(), len(self.count_bins))] += 1
+        self.count_total[name] += value
+        if value > self.count_max[name]:
+            self.count_max[name] = value
+
+    def merge(self, other):
+        """
+        Adds the histograms and totals of another SortStats into this one.
+        """
+        self.frames += other.frames
+        for stage in self.stages:
+            self.time_hist[stage] += other.time_hist[stage]
+            self.time_total[stage] += other.time_total[stage]
+            self.time_max[stage] = max(self.time_max[stage], other.time_max[stage])
+        for name in self.counters:
+            self.count_hist[name] += other.count_hist[name]
+            self.count_total[name] += other.count_total[name]
+            self.count_max[name] = max(self.count_max[name], other.count_max[name])
+
+    @staticmethod
+    def _percentile(hist, edges, q):
+        # upper edge of the bin that holds the q-th percentile
+        if hist.sum() == 0:
+            return 0.
+        b = int(np.searchsorted(np.cumsum(hist), q / 100. * hist.sum()))
+        return float(edges[min(b, len(edges) - 1)])
+
+    def percentile(self, stage, q):
+        """
+        Returns an upper bound, at histogram resolution, on the q-th percentile of a stage's time in seconds.
+        """
+        return self._percentile(self.time_hist[stage], self.time_bins, q)
+
+    def summary(self):
+        """
+        Returns the totals, means, maxima, p50 and p99 of every stage and counter as a JSON-friendly dict.
+        """
+        frames = max(self.frames, 1)
+        stages = {}
+        for stage in self.stages:
+            stages[stage] = {'total_s': self.time_total[stage], 'mean_s': self.time_total[stage] / frames,
+                             'max_s': self.time_max[stage], 'p50_s': self.percentile(stage, 50),
+                             'p99_s': self.percentile(stage, 99), 'histogram': self.time_hist[stage].tolist()}
+        counters = {}
+        for name in self.counters:
+            counters[name] = {'total': self.count_total[name], 'mean': self.count_total[name] / float(frames),
+                              'max': self.count_max[name],
+                              'p50': self._percentile(self.count_hist[name], self.count_bins, 50),
+                              'p99': self._percentile(self.count_hist[name], self.count_bins, 99),
+                              'histogram': self.count_hist[name].tolist()}
+        return {'frames': self.frames, 'time_bin_edges_s': self.time_bins.tolist(),
+                'count_bin_edges': self.count_bins.tolist(), 'stages': stages, 'counters': counters}
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+class TrajectoryStore(object):
+    """
+    Array-backed record of every reported track, kept as frame, stream, id, box and score columns
+    that grow geometrically. With max_rows set, the columns stop growing at max_rows and act as a
+    ring buffer that keeps the newest rows.
+    """
+    fields = ('frame', 'stream', 'id', 'box', 'score')
+
+    def __init__(self, capacity=1024, max_rows=None):
+        if max_rows is not None:
+            capacity = min(capacity, max_rows)
+        self.max_rows = max_rows
+        self._data = self._allocate(max(capacity, 1))
+        self._start = 0
+        self._size = 0
+
+    @staticmethod
+    def _allocate(capacity):
+        return {'frame': np.zeros(capacity, dtype=np.int64), 'stream': np.zeros(capacity, dtype=np.int64),
+                'id': np.zeros(capacity, dtype=np.int64), 'box': np.zeros((capacity, 4)),
+                'score': np.zeros(capacity)}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._data['frame'])
+
+    def append(self, frame, ids, boxes, scores, streams=0):
+        """
+        Records the tracks reported for one frame.
+        """
+        n = len(ids)
+        if n == 0:
+            return
+        rows = {'frame': np.full(n, frame), 'stream': np.broadcast_to(streams, (n,)), 'id': ids,
+                'box': np.asarray(boxes)[:, :4], 'score': scores}
+        if self.max_rows is not None and n > self.max_rows:
+            rows = {name: column[n - self.max_rows:] for name, column in rows.items()}
+            n = self.max_rows
+        limit = self.max_rows or np.inf
+        if self._size + n > self.capacity and self.capacity < limit:
+            capacity = int(min(max(self._size + n, 2 * self.capacity), limit))
+            data = self._allocate(capacity)
+            for name, column in self.columns().items():
+                data[name][:self._size] = column
+            self._data = data
+            self._start = 0
+        pos = (self._start + self._size + np.arange(n)) % self.capacity
+        for name in self.fields:
+            self._data[name][pos] = rows[name]
+        overflow = max(0, self._size + n - self.capacity)
+        self._start = (self._start + overflow) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def columns(self):
+        """
+        Returns the retained rows as a dict of arrays in the order they were recorded.
+        """
+        if self._start + self._size <= self.capacity:
+            return {name: column[self._start:self._start + self._size] for name, column in self._data.items()}
+        pos = (self._start + np.arange(self._size)) % self.capacity
+        return {name: column[pos] for name, column in self._data.items()}
+
+    def by_frame(self, start, stop=None):
+        """
+        Returns the rows of frames start <= frame < stop (only frame start if stop is None).
+        """
+        columns = self.columns()
+        lo, hi = np.searchsorted(columns['frame'], [start, start + 1 if stop is None else stop])
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def by_track(self, track_id, stream=0):
+        """
+        Returns the rows of one track in frame order.
+        """
+        columns = self.columns()
+        mask = (columns['id'] == track_id) & (columns['stream'] == stream)
+        return {name: column[mask] for name, column in columns.items()}
+
+    def to_npz(self, path):
+        np.savez(path, **self.columns())
+
+    def to_csv(self, path):
+        columns = self.columns()
+        table = np.column_stack((columns['frame'], columns['stream'], columns['id'], columns['box'], columns['score']))
+        np.savetxt(path, table, delimiter=',', fmt=['%d', '%d', '%d', '%.2f', '%.2f', '%.2f', '%.2f', '%.4f'],
+                   header='frame,stream,id,x1,y1,x2,y2,score', comments='')
 
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+    @classmethod
+    def from_npz(cls, path, max_rows=None):
+        with np.load(path) as data:
+            store = cls(capacity=max(len(data['frame']), 1), max_rows=max_rows)
+            frames = data['frame']
+            bounds = np.flatnonzero(np.diff(frames)) + 1
+            for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(frames)]):
+                if hi > lo:
+                    store.append(frames[lo], data['id'][lo:hi], data['box'][lo:hi], data['score'][lo:hi],
+                                 data['stream'][lo:hi])
+        return store
+
+
+def stitch_tracks(first, second, start, stop, iou_threshold=0.3, solver=None):
+    """
+    Matches the tracks of two trackers that both ran over frames start <= frame < stop, such as two shards
+      of one video that overlap. first and second are TrajectoryStore columns in frame order. Tracks are
+      paired by their IOU summed over the shared frames, and a pair is kept when its mean IOU over the
+      frames where both tracks were reported reaches iou_threshold. Returns a Kx2 array of (first id,
+      second id) pairs.
+    """
+    a = {name: column[(first['frame'] >= start) & (first['frame'] < stop)] for name, column in first.items()}
+    b = {name: column[(second['frame'] >= start) & (second['frame'] < stop)] for name, column in second.items()}
+    ids_a, index_a = np.unique(a['id'], return_inverse=True)
+    ids_b, index_b = np.unique(b['id'], return_inverse=True)
+    if len(ids_a) == 0 or len(ids_b) == 0:
+        return np.empty((0, 2), dtype=int)
+    total = np.zeros((len(ids_a), len(ids_b)))
+    shared = np.zeros((len(ids_a), len(ids_b)))
+    for frame in np.intersect1d(a['frame'], b['frame']):
+        lo_a, hi_a = np.searchsorted(a['frame'], [frame, frame + 1])
+        lo_b, hi_b = np.searchsorted(b['frame'], [frame, frame + 1])
+        cells = np.ix_(index_a[lo_a:hi_a], index_b[lo_b:hi_b])
+        total[cells] += iou_batch(a['box'][lo_a:hi_a], b['box'][lo_b:hi_b])
+        shared[cells] += 1
+    matched = np.asarray(linear_assignment(-total, solver), dtype=int).reshape(-1, 2)
+    mean_iou = total[matched[:, 0], matched[:, 1]] / np.maximum(shared[matched[:, 0], matched[:, 1]], 1)
+    matched = matched[mean_iou >= iou_threshold]
+    return np.stack((ids_a[matched[:, 0]], ids_b[matched[:, 1]]), axis=1)
+
+
+def save_state(path, state):
+    """
+    Writes a dict of arrays to an .npz file atomically, so a crash mid-write keeps the previous file.
+    """
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **state)
+    os.replace(path + '.tmp', path)
 
 
 class Sort(object):
-    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, sparse=False, solver=None, trajectories=None,
+                 instrument=False):
         """
         Sets key parameters for SORT
+
+        sparse - use the spatially gated sparse association, which scales to thousands of objects per frame
+        solver - assignment backend, one of ASSIGNMENT_SOLVERS (default DEFAULT_SOLVER)
+        trajectories - optional TrajectoryStore that records every reported track
+        instrument - collect per-stage timings and counters in self.stats (a SortStats)
         """
+        if solver is not None and solver not in ASSIGNMENT_SOLVERS:
+            raise ValueError("Unknown assignment solver %r, expected one of %s" % (solver, sorted(ASSIGNMENT_SOLVERS)))
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
-        self.trackers = []
+        self.sparse = sparse
+        self.solver = solver or DEFAULT_SOLVER
+        self.trajectories = trajectories
+        self.stats = SortStats() if instrument else None
+        self.tracks = KalmanBoxBank()
         self.frame_count = 0
+        self.last_births = 0
+        self.last_misses = 0
 
     def update(self, dets=np.empty((0, 5))):
         """
@@ -222,40 +752,333 @@ class Sort(object):
         NOTE: The number of objects returned may differ from the number of detections provided.
         """
         self.frame_count += 1
+        boxes, ids, _, scores = self._step(dets)
+        if self.trajectories is not None:
+            self.trajectories.append(self.frame_count, ids + 1, boxes, scores)
+        if (len(boxes) > 0):
+            return np.concatenate((boxes, ids[:, None] + 1.), axis=1)  # +1 as MOT benchmark requires positive
+        return np.empty((0, 5))
+
+    def state_dict(self):
+        """
+        Returns the complete tracker state as a dict of arrays: every track's Kalman state, covariance and
+          counters, frame_count, the births and misses of the last update and the global
+          KalmanBoxTracker.count ID counter.
+        """
+        state = {'track_' + name: getattr(self.tracks, name) for name in KalmanBoxBank.columns}
+        state.update(frame_count=self.frame_count, id_count=KalmanBoxTracker.count, max_age=self.max_age,
+                     min_hits=self.min_hits, iou_threshold=self.iou_threshold, last_births=self.last_births,
+                     last_misses=self.last_misses)
+        return state
+
+    def load_state_dict(self, state):
+        """
+        Restores a state returned by state_dict, so that later updates produce the same IDs and boxes as the
+          tracker it was taken from.
+        """
+        for name in KalmanBoxBank.columns:
+            setattr(self.tracks, name, np.array(state['track_' + name]))
+        self.frame_count = int(state['frame_count'])
+        KalmanBoxTracker.count = int(state['id_count'])
+        self.max_age = int(state['max_age'])
+        self.min_hits = int(state['min_hits'])
+        self.iou_threshold = float(state['iou_threshold'])
+        self.last_births = int(state.get('last_births', 0))
+        self.last_misses = int(state.get('last_misses', 0))
+
+    def save(self, path, **extra):
+        """
+        Writes state_dict, plus any extra arrays, to an .npz checkpoint. The file is replaced atomically.
+        """
+        save_state(path, dict(self.state_dict(), **extra))
+
+    def load(self, path):
+        """
+        Restores a checkpoint written by save and returns all of its arrays.
+        """
+        with np.load(path) as data:
+            state = dict(data)
+        self.load_state_dict(state)
+        return state
+
+    def coast(self):
+        """
+        Advances every track by one frame on its Kalman prediction alone, for frames where the detector is
+          skipped. The frame counts towards frame_count, but tracks are not aged, so a gap between updates
+          counts as a single frame towards max_age.
+        Returns the predicted boxes of the tracks the last update reported, in the format update uses, and
+          records them in trajectories under this frame.
+        """
+        self.frame_count += 1
+        boxes = self.tracks.predict(advance_counters=False)
+        emit = self._reported()
+        if self.trajectories is not None:
+            self.trajectories.append(self.frame_count, self.tracks.ids[emit] + 1, boxes[emit],
+                                     self.tracks.scores[emit], self.tracks.streams[emit])
+        if (len(emit) > 0):
+            return np.concatenate((boxes[emit], self.tracks.ids[emit, None] + 1.), axis=1)
+        return np.empty((0, 5))
+
+    def _reported(self):
+        """
+        Returns the positions of the tracks to report, in reporting order.
+        """
+        tracks = self.tracks
+        return np.flatnonzero((tracks.time_since_update < 1) & (
+                (tracks.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits)))[::-1]
+
+    def _new_ids(self, streams):
+        """
+        Returns the IDs for tracks born in the given streams.
+        """
+        ids = np.arange(KalmanBoxTracker.count, KalmanBoxTracker.count + len(streams), dtype=np.int64)
+        KalmanBoxTracker.count += len(streams)
+        return ids
+
+    def _step(self, dets, det_streams=None):
+        """
+        Runs one predict, associate, update, birth and prune cycle over all tracks. Returns the boxes,
+          IDs, streams and last detection scores of the tracks to report, in reporting order.
+        """
+        stats = self.stats
+        if stats is not None:
+            start_time = time.perf_counter()
+            n_tracks = len(self.tracks)
         # get predicted locations from existing trackers.
-        trks = np.zeros((len(self.trackers), 5))
-        to_del = []
-        ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
-        trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
-        for t in reversed(to_del):
-            self.trackers.pop(t)
-        matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets, trks, self.iou_threshold)
+        trks = self.tracks.predict()
+        valid = ~np.any(np.isnan(trks), axis=1)
+        if not valid.all():
+            self.tracks.keep(valid)
+            trks = trks[valid]
+        if stats is not None:
+            start_time = stats.lap('predict', start_time)
+        matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(
+            dets, trks, self.iou_threshold, sparse=self.sparse, solver=self.solver,
+            det_groups=det_streams, trk_groups=None if det_streams is None else self.tracks.streams, stats=stats)
+        if stats is not None:
+            start_time = time.perf_counter()
 
         # update matched trackers with assigned detections
-        for m in matched:
-            self.trackers[m[1]].update(dets[m[0], :])
+        self.tracks.update(matched[:, 1], dets[matched[:, 0], :])
 
         # create and initialise new trackers for unmatched detections
-        for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i, :])
-            self.trackers.append(trk)
-        i = len(self.trackers)
-        for trk in reversed(self.trackers):
-            d = trk.get_state()[0]
-            if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
-                ret.append(np.concatenate((d, [trk.id + 1])).reshape(1, -1))  # +1 as MOT benchmark requires positive
-            i -= 1
-            # remove dead tracklet
-            if (trk.time_since_update > self.max_age):
-                self.trackers.pop(i)
-        if (len(ret) > 0):
-            return np.concatenate(ret)
-        return np.empty((0, 5))
+        streams = np.zeros(len(unmatched_dets), dtype=np.int64) if det_streams is None else det_streams[unmatched_dets]
+        self.tracks.add(dets[unmatched_dets, :], self._new_ids(streams), streams)
+        if stats is not None:
+            start_time = stats.lap('update', start_time)
+
+        tracks = self.tracks
+        emit = self._reported()
+        reported = tracks.get_state()[emit], tracks.ids[emit], tracks.streams[emit], tracks.scores[emit]
+        if stats is not None:
+            start_time = stats.lap('output', start_time)
+        # remove dead tracklet
+        tracks.keep(tracks.time_since_update <= self.max_age)
+        self.last_births = len(unmatched_dets)
+        self.last_misses = len(unmatched_trks)
+        if stats is not None:
+            stats.lap('prune', start_time)
+            stats.frames += 1
+            stats.add_count('tracks', len(tracks))
+            stats.add_count('detections', len(dets))
+            stats.add_count('matches', len(matched))
+            stats.add_count('births', len(unmatched_dets))
+            stats.add_count('deaths', n_tracks + len(unmatched_dets) - len(tracks))
+        return reported
+
+
+class DetectionStride(object):
+    """
+    Decides how many frames a Sort tracker coasts on Kalman predictions between detector passes.
+      With max_stride above min_stride the stride adapts: it halves after an update where more than
+      max_churn of the tracks were born or missed, or where a track's predicted position could drift by
+      more than max_drift box sizes before the next pass, and grows by one frame when the scene was stable.
+    """
+
+    def __init__(self, min_stride=1, max_stride=None, max_drift=0.25, max_churn=0.1):
+        self.min_stride = max(1, min_stride)
+        self.max_stride = self.min_stride if max_stride is None else max(self.min_stride, max_stride)
+        self.max_drift = max_drift
+        self.max_churn = max_churn
+        self.stride = self.min_stride
+
+    def state_dict(self):
+        return {'stride': self.stride}
+
+    def load_state_dict(self, state):
+        self.stride = int(state.get('stride', self.stride))
+
+    def update(self, tracker):
+        """
+        Returns the number of frames until the next detector pass, given the tracker right after an update.
+        """
+        if self.max_stride == self.min_stride:
+            return self.stride
+        tracks = tracker.tracks
+        # velocity standard deviation per frame of the confirmed tracks, relative to the box size;
+        # newborn tracks are uncertain by construction and already count towards the churn
+        confirmed = tracks.hit_streak >= tracker.min_hits
+        drift = np.sqrt(tracks.P[confirmed, 4, 4] + tracks.P[confirmed, 5, 5]) / np.sqrt(
+            np.maximum(tracks.x[confirmed, 2], 1e-6))
+        uncertain = len(drift) > 0 and drift.max() * self.stride > self.max_drift
+        churn = tracker.last_births + tracker.last_misses
+        if churn > self.max_churn * len(tracks) or uncertain:
+            self.stride = max(self.min_stride, self.stride // 2)
+        else:
+            self.stride = min(self.max_stride, self.stride + 1)
+        return self.stride
+
+
+class MultiSort(Sort):
+    """
+    Tracks many independent streams (e.g. camera feeds) with one batched SORT cycle per frame.
+      Every stream is tracked exactly as by its own Sort(sparse=True) instance, with its own ID space
+      and the same IDs, births in the same frame included, but prediction, IOU and association run as
+      single array operations over the tracks of all streams.
+    """
+
+    def __init__(self, n_streams, max_age=1, min_hits=3, iou_threshold=0.3, solver=None, trajectories=None,
+                 instrument=False):
+        """
+        Sets key parameters for SORT and the number of streams
+        """
+        Sort.__init__(self, max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold, sparse=True,
+                      solver=solver, trajectories=trajectories, instrument=instrument)
+        self.n_streams = n_streams
+        self.next_ids = np.zeros(n_streams, dtype=np.int64)
+
+    def update(self, dets_per_stream):
+        """
+        Params:
+          dets_per_stream - a sequence of n_streams detection arrays, each in the format Sort.update takes
+        Requires: this method must be called once for each frame, with an entry for every stream.
+        Returns a list with one array per stream, as Sort(sparse=True).update would for that stream.
+        """
+        if len(dets_per_stream) != self.n_streams:
+            raise ValueError("Expected detections for %d streams, got %d" % (self.n_streams, len(dets_per_stream)))
+        self.frame_count += 1
+        dets = [np.reshape(d, (-1, 5)) for d in dets_per_stream]
+        det_streams = np.repeat(np.arange(self.n_streams), [len(d) for d in dets])
+        boxes, ids, streams, scores = self._step(np.concatenate(dets), det_streams)
+        if self.trajectories is not None:
+            self.trajectories.append(self.frame_count, ids + 1, boxes, scores, streams)
+
+        order = np.argsort(streams, kind='stable')
+        ret = np.concatenate((boxes[order], ids[order, None] + 1.), axis=1)  # +1 as MOT benchmark requires positive
+        return np.split(ret, np.cumsum(np.bincount(streams, minlength=self.n_streams))[:-1])
+
+    def state_dict(self):
+        state = Sort.state_dict(self)
+        state['next_ids'] = self.next_ids
+        return state
+
+    def load_state_dict(self, state):
+        Sort.load_state_dict(self, state)
+        self.next_ids = np.array(state['next_ids'])
+        self.n_streams = len(self.next_ids)
+
+    def _new_ids(self, streams):
+        """
+        Returns the IDs for tracks born in the given streams, counting separately in every stream.
+        """
+        order = np.argsort(streams, kind='stable')
+        first = np.searchsorted(streams[order], streams[order])
+        ids = np.empty(len(streams), dtype=np.int64)
+        ids[order] = self.next_ids[streams[order]] + np.arange(len(streams)) - first
+        self.next_ids += np.bincount(streams, minlength=self.n_streams)
+        return ids
+
+
+def load_detections(det_path, cache=True):
+    """
+    Loads a MOT det.txt as (boxes, offsets): boxes is an Mx5 array of [x1,y1,x2,y2,score] rows sorted
+      by frame, and the detections of frame f are boxes[offsets[f - 1]:offsets[f]].
+    The text file is parsed once; the result is cached next to it as .npy files that later runs
+      memory-map, as long as they are newer than det_path.
+    """
+    boxes_fn = det_path + '.boxes.npy'
+    offsets_fn = det_path + '.offsets.npy'
+    if cache and all(os.path.exists(fn) and os.path.getmtime(fn) >= os.path.getmtime(det_path)
+                     for fn in (boxes_fn, offsets_fn)):
+        return np.load(boxes_fn, mmap_mode='r'), np.load(offsets_fn)
+
+    seq_dets = np.loadtxt(det_path, delimiter=',', ndmin=2)
+    seq_dets = seq_dets[np.argsort(seq_dets[:, 0], kind='stable')] if len(seq_dets) else np.zeros((0, 7))
+    frames = seq_dets[:, 0].astype(np.int64)
+    boxes = np.ascontiguousarray(seq_dets[:, 2:7])
+    boxes[:, 2:4] += boxes[:, 0:2]  # convert to [x1,y1,w,h] to [x1,y1,x2,y2]
+    offsets = np.searchsorted(frames, np.arange(frames.max() + 1 if len(frames) else 1), side='right')
+    if cache:
+        try:
+            for fn, array in ((boxes_fn, boxes), (offsets_fn, offsets)):
+                with open(fn + '.tmp', 'wb') as f:
+                    np.save(f, array)
+                os.replace(fn + '.tmp', fn)
+        except OSError as e:
+            print("Warning: could not cache detections for %s: %s" % (det_path, e))
+    return boxes, offsets
+
+
+def iter_frames(boxes, offsets):
+    """
+    Yields (frame, dets) for every frame of a sequence loaded with load_detections. Frame numbers
+      begin at 1 and dets is a view into boxes, not a copy.
+    """
+    for frame in range(1, len(offsets)):
+        yield frame, boxes[offsets[frame - 1]:offsets[frame]]
+
+
+def track_sequence(seq_dets_fn, seq, args, display=None):
+    """
+    Runs SORT over one MOT sequence and writes output/<seq>.txt.
+      display is an optional (fig, ax1, colours) tuple used to draw the tracks as they are found.
+    Returns (seq, total_time, total_frames, stats), where stats is the tracker's SortStats or None.
+    """
+    if (display):
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+        from skimage import io
+        fig, ax1, colours = display
+    total_time = 0.0
+    total_frames = 0
+    KalmanBoxTracker.count = 0  # IDs start at 1 in every sequence, whichever worker runs it
+    mot_tracker = Sort(max_age=args.max_age,
+                       min_hits=args.min_hits,
+                       iou_threshold=args.iou_threshold,
+                       sparse=args.sparse,
+                       solver=args.solver,
+                       instrument=args.stats is not None)  # create instance of the SORT tracker
+    seq_boxes, seq_offsets = load_detections(seq_dets_fn, cache=not args.no_cache)
+
+    with open(os.path.join('output', '%s.txt' % (seq)), 'w') as out_file:
+        print("Processing %s." % (seq))
+        for frame, dets in iter_frames(seq_boxes, seq_offsets):
+            total_frames += 1
+
+            if (display):
+                fn = os.path.join('mot_benchmark', args.phase, seq, 'img1', '%06d.jpg' % (frame))
+                im = io.imread(fn)
+                ax1.imshow(im)
+                plt.title(seq + ' Tracked Targets')
+
+            start_time = time.time()
+            trackers = mot_tracker.update(dets)
+            cycle_time = time.time() - start_time
+            total_time += cycle_time
+
+            for d in trackers:
+                print('%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1' % (frame, d[4], d[0], d[1], d[2] - d[0], d[3] - d[1]),
+                      file=out_file)
+                if (display):
+                    d = d.astype(np.int32)
+                    ax1.add_patch(patches.Rectangle((d[0], d[1]), d[2] - d[0], d[3] - d[1], fill=False, lw=3,
+                                                    ec=colours[d[4] % 32, :]))
+
+            if (display):
+                fig.canvas.flush_events()
+                plt.draw()
+                ax1.cla()
+    return seq, total_time, total_frames, mot_tracker.stats
 
 
 def parse_args():
@@ -272,6 +1095,16 @@ def parse_args():
                         help="Minimum number of associated detections before track is initialised.",
                         type=int, default=3)
     parser.add_argument("--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3)
+    parser.add_argument('--sparse', dest='sparse', help='Use spatially gated sparse association [False]',
+                        action='store_true')
+    parser.add_argument("--solver", help="Assignment backend [%s]." % DEFAULT_SOLVER, type=str,
+                        choices=sorted(ASSIGNMENT_SOLVERS), default=DEFAULT_SOLVER)
+    parser.add_argument("--workers", help="Number of sequences tracked in parallel (1 with --display).", type=int,
+                        default=os.cpu_count())
+    parser.add_argument("--stats", help="Write per-stage tracker timings and counters to this JSON file.", type=str,
+                        default=None)
+    parser.add_argument('--no_cache', dest='no_cache', help='Do not read or write the binary detection cache [False]',
+                        action='store_true')
     args = parser.parse_args()
     return args
 
@@ -281,14 +1114,17 @@ if __name__ == '__main__':
     args = parse_args()
     display = args.display
     phase = args.phase
-    total_time = 0.0
-    total_frames = 0
     colours = np.random.rand(32, 3)  # used only for display
     if (display):
         if not os.path.exists('mot_benchmark'):
             print(
                 '\n\tERROR: mot_benchmark link not found!\n\n    Create a symbolic link to the MOT benchmark\n    (https://motchallenge.net/data/2D_MOT_2015/#download). E.g.:\n\n    $ ln -s /path/to/MOT2015_challenge/2DMOT2015 mot_benchmark\n\n')
             exit()
+        import matplotlib
+
+        matplotlib.use('TkAgg')
+        import matplotlib.pyplot as plt
+
         plt.ion()
         fig = plt.figure()
         ax1 = fig.add_subplot(111, aspect='equal')
@@ -296,47 +1132,31 @@ if __name__ == '__main__':
     if not os.path.exists('output'):
         os.makedirs('output')
     pattern = os.path.join(args.seq_path, phase, '*', 'det', 'det.txt')
-    for seq_dets_fn in glob.glob(pattern):
-        mot_tracker = Sort(max_age=args.max_age,
-                           min_hits=args.min_hits,
-                           iou_threshold=args.iou_threshold)  # create instance of the SORT tracker
-        seq_dets = np.loadtxt(seq_dets_fn, delimiter=',')
-        seq = seq_dets_fn[pattern.find('*'):].split(os.path.sep)[0]
-
-        with open(os.path.join('output', '%s.txt' % (seq)), 'w') as out_file:
-            print("Processing %s." % (seq))
-            for frame in range(int(seq_dets[:, 0].max())):
-                frame += 1  # detection and frame numbers begin at 1
-                dets = seq_dets[seq_dets[:, 0] == frame, 2:7]
-                dets[:, 2:4] += dets[:, 0:2]  # convert to [x1,y1,w,h] to [x1,y1,x2,y2]
-                total_frames += 1
-
-                if (display):
-                    fn = os.path.join('mot_benchmark', phase, seq, 'img1', '%06d.jpg' % (frame))
-                    im = io.imread(fn)
-                    ax1.imshow(im)
-                    plt.title(seq + ' Tracked Targets')
-
-                start_time = time.time()
-                trackers = mot_tracker.update(dets)
-                cycle_time = time.time() - start_time
-                total_time += cycle_time
-
-                for d in trackers:
-                    print('%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1' % (frame, d[4], d[0], d[1], d[2] - d[0], d[3] - d[1]),
-                          file=out_file)
-                    if (display):
-                        d = d.astype(np.int32)
-                        ax1.add_patch(patches.Rectangle((d[0], d[1]), d[2] - d[0], d[3] - d[1], fill=False, lw=3,
-                                                        ec=colours[d[4] % 32, :]))
-
-                if (display):
-                    fig.canvas.flush_events()
-                    plt.draw()
-                    ax1.cla()
+    sequences = [(seq_dets_fn, seq_dets_fn[pattern.find('*'):].split(os.path.sep)[0])
+                 for seq_dets_fn in sorted(glob.glob(pattern))]
+    wall_start = time.time()
+    if (display) or args.workers <= 1:
+        results = [track_sequence(seq_dets_fn, seq, args, (fig, ax1, colours) if display else None)
+                   for seq_dets_fn, seq in sequences]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(track_sequence, *zip(*sequences), [args] * len(sequences)))
+    wall_time = time.time() - wall_start
 
+    total_time = sum(r[1] for r in results)
+    total_frames = sum(r[2] for r in results)
+    for seq, seq_time, seq_frames, _ in results:
+        print("%s: %d frames in %.3f seconds or %.1f FPS" % (seq, seq_frames, seq_time, seq_frames / max(seq_time, 1e-9)))
+    if args.stats is not None:
+        stats = SortStats()
+        for r in results:
+            stats.merge(r[3])
+        stats.dump_json(args.stats)
     print("Total Tracking took: %.3f seconds for %d frames or %.1f FPS" % (
     total_time, total_frames, total_frames / total_time))
+    if len(results) > 1:
+        print("Wall time: %.3f seconds over %d sequences with %d workers" % (
+            wall_time, len(results), 1 if display else max(1, min(args.workers, len(results)))))
 
     if (display):
-        print("Note: to get real runtime results run without the option: --display")
\ No newline at end of file
+        print("Note: to get real runtime results run without the option: --display")
@@ -0,0 +1,323 @@
+"""
+Benchmarks for the SORT tracker in sort.py on synthetic frames.
+
+    $ python sort_benchmark.py solvers --sizes 100 1000 3000
+    $ python sort_benchmark.py scenes --sizes 10 100 1000 5000 --sparse --json current.json --baseline baseline.json
+    $ python sort_benchmark.py stride --sizes 10 100 --strides 1 2 4 8 --max_stride 8
+
+The scenes suite exits with status 1 when a result regresses against the baseline file.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from sort import (ASSIGNMENT_SOLVERS, DEFAULT_SOLVER, DetectionStride, KalmanBoxTracker, Sort,
+                  associate_detections_to_trackers, iou_batch, linear_assignment)
+
+
+def random_boxes(rng, n, side, min_size=10., max_size=60.):
+    """
+    Returns n random boxes [x1,y1,x2,y2] inside a side x side frame.
+    """
+    xy = rng.uniform(0, side, (n, 2))
+    wh = rng.uniform(min_size, max_size, (n, 2))
+    return np.concatenate((xy, xy + wh), axis=1)
+
+
+def synthetic_assignment_frame(rng, n, clutter=0.1, jitter=4.):
+    """
+    Builds one frame worth of association input: n predicted track boxes, and detections that are
+      jittered copies of them plus clutter, shuffled. The frame area grows with n so that the
+      density of objects stays constant.
+    """
+    side = 100. * np.sqrt(n)
+    trks = random_boxes(rng, n, side)
+    dets = trks + rng.normal(0, jitter, trks.shape)
+    dets = np.concatenate((dets, random_boxes(rng, int(n * clutter), side)))
+    return dets[rng.permutation(len(dets))], trks
+
+
+def benchmark_solvers(sizes, repeats=5, iou_threshold=0.3, seed=0):
+    """
+    Times every assignment backend on synthetic frames and compares the total IOU of its matches
+      above iou_threshold with that of the optimal scipy solution.
+    """
+    results = []
+    for n in sizes:
+        rng = np.random.default_rng(seed)
+        frames = [synthetic_assignment_frame(rng, n) for _ in range(repeats)]
+        costs = [-iou_batch(dets, trks) for dets, trks in frames]
+        optimal = None
+        for name in ['scipy'] + sorted(set(ASSIGNMENT_SOLVERS) - {'scipy'}):
+            times = []
+            total_iou = 0.
+            total_matches = 0
+            for cost in costs:
+                start_time = time.perf_counter()
+                matched = linear_assignment(cost, name)
+                times.append(time.perf_counter() - start_time)
+                iou = -cost[matched[:, 0], matched[:, 1]]
+                total_iou += iou[iou >= iou_threshold].sum()
+                total_matches += int((iou >= iou_threshold).sum())
+            if optimal is None:
+                optimal = total_iou
+            results.append({'solver': name, 'size': n, 'median_ms': 1000. * float(np.median(times)),
+                            'max_ms': 1000. * float(np.max(times)), 'matches': total_matches / float(repeats),
+                            'iou_ratio': float(total_iou / optimal) if optimal > 0 else 1.})
+    return results
+
+
+def synthetic_scene(n, frames=100, seed=0, noise=2., dropout=0.05, false_positives=0.02, crossing=0.2):
+    """
+    Generates a deterministic scene of n boxes moving at constant velocity and bouncing off the frame
+      edges. A fraction of them (crossing) is set up in pairs that pass through each other halfway
+      through the sequence. Returns a list of (gt, dets) per frame: gt rows are [x1,y1,x2,y2,id] and
+      dets rows are [x1,y1,x2,y2,score], with position noise, missed detections (dropout) and
+      n * false_positives clutter boxes per frame on average.
+    """
+    rng = np.random.default_rng(seed)
+    side = 100. * np.sqrt(n)
+    size = rng.uniform(15, 50, (n, 2))
+    pos = rng.uniform(0, side - size)
+    vel = rng.normal(0, 2, (n, 2))
+    pairs = rng.permutation(n)[:int(n * crossing) // 2 * 2].reshape(-1, 2)
+    meet = pos[pairs[:, 0]] + vel[pairs[:, 0]] * frames / 2.
+    vel[pairs[:, 1]] = -vel[pairs[:, 0]]
+    pos[pairs[:, 1]] = meet + vel[pairs[:, 0]] * frames / 2.
+
+    scene = []
+    for _ in range(frames):
+        pos += vel
+        bounce = (pos < 0) | (pos > side - size)
+        vel[bounce] *= -1
+        pos = np.clip(pos, 0, side - size)
+        gt = np.concatenate((pos, pos + size, np.arange(n)[:, None]), axis=1)
+        seen = gt[rng.random(n) >= dropout, :4]
+        seen = seen + rng.normal(0, noise, seen.shape)
+        clutter = random_boxes(rng, rng.poisson(n * false_positives), side)
+        dets = np.concatenate((seen, clutter))
+        dets = np.concatenate((dets, rng.uniform(0.5, 1., (len(dets), 1))), axis=1)
+        scene.append((gt, dets[rng.permutation(len(dets))]))
+    return scene
+
+
+def evaluate_tracks(scene, tracks, iou_threshold=0.5):
+    """
+    Simplified CLEAR-MOT scoring of the tracker output (one [x1,y1,x2,y2,id] array per frame) against
+      the scene ground truth. Hypotheses are matched to ground truth per frame by IOU, and an ID
+      switch is counted whenever a ground-truth object is matched to a different ID than last time.
+    """
+    fn = fp = idsw = matches = 0
+    total_iou = 0.
+    last_id = {}
+    for (gt, _), hyp in zip(scene, tracks):
+        matched, unmatched_hyp, unmatched_gt = associate_detections_to_trackers(hyp, gt, iou_threshold, sparse=True)
+        fn += len(unmatched_gt)
+        fp += len(unmatched_hyp)
+        matches += len(matched)
+        if len(matched):
+            total_iou += iou_batch(hyp[matched[:, 0], :4], gt[matched[:, 1], :4]).diagonal().sum()
+        for h, g in zip(hyp[matched[:, 0], 4], gt[matched[:, 1], 4]):
+            if last_id.get(g, h) != h:
+                idsw += 1
+            last_id[g] = h
+    n_gt = sum(len(gt) for gt, _ in scene)
+    return {'mota': 1. - (fn + fp + idsw) / float(n_gt), 'motp': total_iou / max(matches, 1),
+            'recall': matches / float(n_gt), 'precision': matches / float(max(matches + fp, 1)),
+            'id_switches': idsw, 'false_positives': fp, 'false_negatives': fn}
+
+
+def benchmark_scene(n, frames=100, seed=0, memory_frames=20, **tracker_kwargs):
+    """
+    Drives Sort.update and associate_detections_to_trackers through a synthetic scene of n objects.
+      Reports per-frame latency percentiles, the peak memory traced over the first memory_frames
+      frames, and tracking accuracy against ground truth.
+    """
+    scene = synthetic_scene(n, frames=frames, seed=seed)
+    warm_up = Sort(**tracker_kwargs)
+    for _, dets in scene[:2]:
+        warm_up.update(dets)  # warm up lazy imports
+
+    KalmanBoxTracker.count = 0
+    tracker = Sort(**tracker_kwargs)
+    update_times = []
+    tracks = []
+    for _, dets in scene:
+        start_time = time.perf_counter()
+        tracks.append(tracker.update(dets))
+        update_times.append(time.perf_counter() - start_time)
+
+    associate_times = []
+    for (prev_gt, _), (_, dets) in zip(scene[:-1], scene[1:]):
+        start_time = time.perf_counter()
+        associate_detections_to_trackers(dets, prev_gt[:, :4], tracker.iou_threshold, sparse=tracker.sparse,
+                                         solver=tracker.solver)
+        associate_times.append(time.perf_counter() - start_time)
+
+    # memory is traced in a separate pass, as tracemalloc slows down every allocation
+    KalmanBoxTracker.count = 0
+    tracker = Sort(**tracker_kwargs)
+    tracemalloc.start()
+    for _, dets in scene[:memory_frames]:
+        tracker.update(dets)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    update_ms = 1000. * np.array(update_times)
+    associate_ms = 1000. * np.array(associate_times)
+    result = {'size': n, 'frames': frames,
+              'update_mean_ms': float(update_ms.mean()),
+              'update_p50_ms': float(np.percentile(update_ms, 50)),
+              'update_p99_ms': float(np.percentile(update_ms, 99)),
+              'associate_p50_ms': float(np.percentile(associate_ms, 50)) if len(associate_ms) else 0.,
+              'associate_p99_ms': float(np.percentile(associate_ms, 99)) if len(associate_ms) else 0.,
+              'peak_memory_mb': peak_memory / 2. ** 20}
+    result.update(evaluate_tracks(scene, tracks))
+    return result
+
+
+def benchmark_stride(n, frames=100, seed=0, min_stride=1, max_stride=None, max_drift=0.25, max_churn=0.1,
+                     **tracker_kwargs):
+    """
+    Tracks a synthetic scene of n objects with detections only on keyframes chosen by a DetectionStride,
+      coasting on Sort.coast in between. Accuracy is scored on every frame, so it shows what the skipped
+      detector passes cost; detector_fraction is the share of frames that still need the detector.
+    """
+    scene = synthetic_scene(n, frames=frames, seed=seed)
+    KalmanBoxTracker.count = 0
+    tracker = Sort(**tracker_kwargs)
+    stride = DetectionStride(min_stride, max_stride, max_drift, max_churn)
+    tracks = []
+    keyframes = 0
+    next_keyframe = 0
+    start_time = time.perf_counter()
+    for frame, (_, dets) in enumerate(scene):
+        if frame == next_keyframe:
+            tracks.append(tracker.update(dets))
+            next_keyframe += stride.update(tracker)
+            keyframes += 1
+        else:
+            tracks.append(tracker.coast())
+    elapsed = time.perf_counter() - start_time
+    result = {'size': n, 'frames': frames, 'min_stride': stride.min_stride, 'max_stride': stride.max_stride,
+              'keyframes': keyframes, 'detector_fraction': keyframes / float(frames),
+              'track_ms': 1000. * elapsed / frames}
+    result.update(evaluate_tracks(scene, tracks))
+    return result
+
+
+def find_regressions(results, baseline, tolerance=0.2, accuracy_tolerance=0.01):
+    """
+    Compares scene results with a baseline run of the same sizes. Latency may grow by a factor of
+      1 + tolerance and MOTA may drop by accuracy_tolerance before a result counts as a regression.
+      Returns a list of messages, empty when nothing regressed.
+    """
+    previous = {r['size']: r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = previous.get(r['size'])
+        if old is None:
+            continue
+        for key in ('update_p50_ms', 'update_p99_ms', 'associate_p50_ms', 'associate_p99_ms'):
+            if r[key] > old[key] * (1. + tolerance):
+                regressions.append('size %d: %s %.3f > baseline %.3f' % (r['size'], key, r[key], old[key]))
+        if r['mota'] < old['mota'] - accuracy_tolerance:
+            regressions.append('size %d: mota %.4f < baseline %.4f' % (r['size'], r['mota'], old['mota']))
+    return regressions
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='SORT benchmarks')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    solvers = subparsers.add_parser('solvers', help='Compare assignment backends.')
+    solvers.add_argument("--sizes", help="Objects per frame.", type=int, nargs='+', default=[100, 500, 1000, 2000])
+    solvers.add_argument("--repeats", help="Frames per size.", type=int, default=5)
+    solvers.add_argument("--json", help="Write the results to this file.", type=str, default=None)
+    scenes = subparsers.add_parser('scenes', help='Run the synthetic-scene suite.')
+    scenes.add_argument("--sizes", help="Objects per scene.", type=int, nargs='+', default=[10, 100, 1000, 5000])
+    scenes.add_argument("--frames", help="Frames per scene.", type=int, default=100)
+    scenes.add_argument("--seed", help="Scene seed.", type=int, default=0)
+    scenes.add_argument('--sparse', dest='sparse', help='Use spatially gated sparse association [False]',
+                        action='store_true')
+    scenes.add_argument("--solver", help="Assignment backend [%s]." % DEFAULT_SOLVER, type=str,
+                        choices=sorted(ASSIGNMENT_SOLVERS), default=DEFAULT_SOLVER)
+    scenes.add_argument("--json", help="Write the results to this file.", type=str, default=None)
+    scenes.add_argument("--baseline", help="Fail on regressions against this earlier --json file.", type=str,
+                        default=None)
+    scenes.add_argument("--tolerance", help="Allowed relative latency growth.", type=float, default=0.2)
+    scenes.add_argument("--accuracy_tolerance", help="Allowed absolute MOTA drop.", type=float, default=0.01)
+    stride = subparsers.add_parser('stride', help='Measure the accuracy cost of detecting only on keyframes.')
+    stride.add_argument("--sizes", help="Objects per scene.", type=int, nargs='+', default=[10, 100])
+    stride.add_argument("--frames", help="Frames per scene.", type=int, default=100)
+    stride.add_argument("--seed", help="Scene seed.", type=int, default=0)
+    stride.add_argument("--strides", help="Fixed detection strides to compare.", type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    stride.add_argument("--max_stride", help="Also run the adaptive policy up to this stride (0 skips it).",
+                        type=int, default=8)
+    stride.add_argument("--max_drift", help="Predicted drift, in box sizes, that shrinks the adaptive stride.",
+                        type=float, default=0.25)
+    stride.add_argument("--max_churn", help="Share of tracks born or missed in an update that shrinks the adaptive "
+                                            "stride.", type=float, default=0.1)
+    stride.add_argument("--json", help="Write the results to this file.", type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'solvers':
+        results = benchmark_solvers(args.sizes, repeats=args.repeats)
+        print('%-8s %6s %10s %10s %9s %9s' % ('solver', 'size', 'median ms', 'max ms', 'matches', 'iou/opt'))
+        for r in results:
+            print('%-8s %6d %10.2f %10.2f %9.1f %9.4f' % (
+                r['solver'], r['size'], r['median_ms'], r['max_ms'], r['matches'], r['iou_ratio']))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    elif args.command == 'scenes':
+        results = [benchmark_scene(n, frames=args.frames, seed=args.seed, sparse=args.sparse, solver=args.solver)
+                   for n in args.sizes]
+        print('%6s %9s %9s %9s %9s %8s %7s %7s %6s' % (
+            'size', 'p50 ms', 'p99 ms', 'assoc50', 'assoc99', 'mem MB', 'mota', 'motp', 'idsw'))
+        for r in results:
+            print('%6d %9.2f %9.2f %9.2f %9.2f %8.1f %7.4f %7.4f %6d' % (
+                r['size'], r['update_p50_ms'], r['update_p99_ms'], r['associate_p50_ms'], r['associate_p99_ms'],
+                r['peak_memory_mb'], r['mota'], r['motp'], r['id_switches']))
+        report = {'config': {'frames': args.frames, 'seed': args.seed, 'sparse': args.sparse, 'solver': args.solver},
+                  'results': results}
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = find_regressions(results, json.load(f), args.tolerance, args.accuracy_tolerance)
+            for message in regressions:
+                print('REGRESSION: ' + message)
+            if regressions:
+                sys.exit(1)
+    elif args.command == 'stride':
+        policies = [(k, k) for k in args.strides]
+        if args.max_stride > 0:
+            policies.append((1, args.max_stride))
+        results = [benchmark_stride(n, frames=args.frames, seed=args.seed, min_stride=lo, max_stride=hi,
+                                    max_drift=args.max_drift, max_churn=args.max_churn, sparse=True)
+                   for n in args.sizes for lo, hi in policies]
+        print('%6s %8s %9s %9s %7s %7s %7s %6s' % (
+            'size', 'stride', 'detector', 'track ms', 'mota', 'motp', 'recall', 'idsw'))
+        for r in results:
+            policy = ('%d' % r['min_stride'] if r['min_stride'] == r['max_stride'] else
+                      '%d-%d' % (r['min_stride'], r['max_stride']))
+            print('%6d %8s %8.0f%% %9.2f %7.4f %7.4f %7.4f %6d' % (
+                r['size'], policy, 100. * r['detector_fraction'], r['track_ms'], r['mota'], r['motp'],
+                r['recall'], r['id_switches']))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
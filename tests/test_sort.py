@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sort
+from sort_benchmark import synthetic_scene
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_multisort_matches_separate_sorts(seed):
+    # busy streams with clutter, so that several tracks are born in the same frame
+    n_streams, frames = 4, 50
+    scenes = [synthetic_scene(8, frames, seed=10 * seed + s, noise=6, dropout=0.2, false_positives=0.3)
+              for s in range(n_streams)]
+    expected = []
+    for scene in scenes:
+        sort.KalmanBoxTracker.count = 0
+        tracker = sort.Sort(sparse=True)
+        expected.append([tracker.update(dets) for _, dets in scene])
+
+    multi = sort.MultiSort(n_streams)
+    for f in range(frames):
+        results = multi.update([scene[f][1] for scene in scenes])
+        for s in range(n_streams):
+            np.testing.assert_allclose(results[s], expected[s][f], err_msg='stream %d, frame %d' % (s, f))
+
+
+def test_coast_counts_frames_and_records_trajectories():
+    sort.KalmanBoxTracker.count = 0
+    trajectories = sort.TrajectoryStore()
+    tracker = sort.Sort(min_hits=3, trajectories=trajectories)
+    box = np.array([[10., 10., 30., 30., 0.9]])
+    for frame in range(1, 14):
+        # detector on every third frame, coasting in between
+        if frame % 3 == 1:
+            tracked = tracker.update(box + [frame, 0, frame, 0, 0])
+        else:
+            tracked = tracker.coast()
+        assert tracker.frame_count == frame
+    # frames 1 to 3 are the warm-up, then the track needs three hits after its birth: frames 4, 7 and 10
+    np.testing.assert_array_equal(trajectories.columns()['frame'], [1, 2, 3, 10, 11, 12, 13])
+    assert len(tracked) == 1 and tracked[0, 4] == 1
@@ -0,0 +1,121 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sort
+import track_birds2
+from video_io import VideoReader
+
+
+class BlobDetector(object):
+    """
+    Stands in for the Faster R-CNN: every dark blob is a bird. Raises on call crash_at, like a run that dies.
+    """
+
+    def __init__(self, crash_at=None):
+        self.calls = 0
+        self.crash_at = crash_at
+
+    def __call__(self, images):
+        self.calls += 1
+        if self.calls == self.crash_at:
+            raise RuntimeError('crash')
+        predictions = []
+        for image in images:
+            dark = (image.mean(0).numpy() < 0.3).astype(np.uint8)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(dark)
+            boxes = torch.tensor([[x, y, x + w, y + h] for x, y, w, h, _ in stats[1:]], dtype=torch.float32)
+            predictions.append({'boxes': boxes.reshape(-1, 4), 'labels': torch.full((len(boxes),), 16),
+                                'scores': torch.full((len(boxes),), 0.9)})
+        return predictions
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    # birds crossing the frame at different speeds, some arriving and leaving mid-video
+    path = str(tmp_path_factory.mktemp('video') / 'birds.avi')
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (320, 240))
+    rng = np.random.default_rng(0)
+    start = rng.uniform(-60, 240, (8, 2)) * [1.5, 0.7]
+    velocity = rng.uniform(-1, 1, (8, 2)) + [1.5, 0]
+    for frame_index in range(90):
+        frame = np.full((240, 320, 3), 255, np.uint8)
+        for x, y in start + velocity * frame_index:
+            cv2.rectangle(frame, (int(x), int(y)), (int(x) + 30, int(y) + 20), (0, 0, 0), -1)
+        out.write(frame)
+    out.release()
+    return path
+
+
+def track(monkeypatch, video, output, options, crash_at=None, detector=None):
+    detector = detector or BlobDetector(crash_at)
+    monkeypatch.setattr(track_birds2, 'load_model', lambda *args, **kwargs: detector)
+    sort.KalmanBoxTracker.count = 0  # as in a new process
+    if '--cache_dir' not in options:
+        options = options + ['--no_cache']
+    args = track_birds2.parse_args(['--input', video, '--output', output + '.mp4', '--tracks', output + '.txt',
+                                    '--batch_size', '1'] + options)
+    track_birds2.track_video(args)
+    with open(output + '.txt') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('options', [['--detect_every', '3', '--no_video'],
+                                     ['--detect_every', '2', '--max_stride', '6', '--no_video'],
+                                     ['--detect_every', '3']])
+def test_resume_matches_uninterrupted_run(monkeypatch, tmp_path, video, options):
+    options = options + ['--checkpoint_every', '10']
+    expected = track(monkeypatch, video, str(tmp_path / 'straight'), options)
+    assert len(expected.splitlines()) > 200
+
+    resumed = str(tmp_path / 'resumed')
+    with pytest.raises(RuntimeError):
+        track(monkeypatch, video, resumed, options, crash_at=9)
+    assert os.path.exists(resumed + '.mp4.ckpt.npz')
+    assert track(monkeypatch, video, resumed, options) == expected
+
+
+@pytest.mark.parametrize('checkpoint_every', [10, 100])
+def test_video_output_with_checkpoints(monkeypatch, tmp_path, video, checkpoint_every):
+    # with 100, the video ends before the first checkpoint
+    track(monkeypatch, video, str(tmp_path / 'out'), ['--checkpoint_every', str(checkpoint_every)])
+    assert sorted(os.listdir(str(tmp_path))) == ['out.mp4', 'out.txt']
+    with VideoReader(str(tmp_path / 'out.mp4')) as reader:
+        assert sum(1 for _ in reader) == 90
+
+
+def test_roi_does_not_use_the_detection_cache(monkeypatch, tmp_path, video):
+    options = ['--cache_dir', str(tmp_path / 'cache'), '--no_video']
+    track(monkeypatch, video, str(tmp_path / 'full'), options)
+    assert os.listdir(str(tmp_path / 'cache'))
+
+    detector = BlobDetector()
+    track(monkeypatch, video, str(tmp_path / 'roi'), options + ['--roi'], detector=detector)
+    assert detector.calls > 0
+
+
+def shard_tracks(*tracks):
+    # TrajectoryStore columns in frame order from (id, first frame, stop frame, x) tracks of fixed-size boxes
+    rows = [(frame, track_id, x + frame) for track_id, start, stop, x in tracks for frame in range(start, stop)]
+    frame, track_id, x = np.array(sorted(rows), dtype=float).T
+    return {'frame': frame.astype(int), 'id': track_id.astype(int),
+            'box': np.column_stack((x, np.zeros_like(x), x + 20, np.full_like(x, 20)))}
+
+
+def test_stitch_shards_numbers_only_written_tracks():
+    # two shards cut at frame 50 that both track frames 40 to 59
+    first = shard_tracks((1, 0, 60, 0), (2, 52, 60, 500))
+    second = shard_tracks((5, 40, 100, 0), (6, 40, 48, 800), (7, 60, 100, 300))
+    rows = track_birds2.stitch_shards([first, second], [0, 50, 100], 10)
+
+    assert len(rows) == 50 + 50 + 40
+    np.testing.assert_array_equal(rows[:, 0], np.sort(rows[:, 0]))
+    # track 1 carries over the cut as track 5; 2 and 6 only exist in the overlap, outside their shard
+    np.testing.assert_array_equal(np.unique(rows[rows[:, 2] - rows[:, 0] == 0, 1]), [1])
+    np.testing.assert_array_equal(np.unique(rows[:, 1]), [1, 2])
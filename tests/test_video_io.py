@@ -0,0 +1,38 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_io import VideoReader
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    # frame i is filled with grey level 40 * i, so every frame can be told apart after lossy encoding
+    path = str(tmp_path_factory.mktemp('video') / 'frames.avi')
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+    for i in range(5):
+        out.write(np.full((48, 64, 3), 40 * i, np.uint8))
+    out.release()
+    return path
+
+
+def frame_numbers(reader):
+    with reader:
+        return reader.frame_count, [int(round(frame.mean() / 40.)) for frame in reader]
+
+
+@pytest.mark.parametrize('skip, start, expected', [(1, 0, [0, 1, 2, 3, 4]), (2, 0, [0, 2, 4]), (3, 0, [0, 3]),
+                                                   (2, 1, [1, 3]), (3, 2, [2])])
+def test_skip_keeps_every_skipth_frame_from_start(video, skip, start, expected):
+    frame_count, numbers = frame_numbers(VideoReader(video, skip=skip, start=start))
+    assert numbers == expected
+    assert frame_count == len(expected)
+
+
+def test_count_limits_the_kept_frames(video):
+    assert frame_numbers(VideoReader(video, skip=2, start=1, count=1)) == (1, [1])
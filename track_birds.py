@@ -1,101 +1,262 @@
-import cv2
-import numpy as np
+import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Load video
-video_path = 'input.mp4'
-print(os.listdir())
-if not os.path.exists(video_path):
-    print(f"Error: Video file '{video_path}' does not exist.")
-    exit()
-
-cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)  # Explicit FFMPEG backend
-
-# Check if video opened
-if not cap.isOpened():
-    print("Error: Could not open input video. Check file format or OpenCV FFMPEG support.")
-    print(f"File path: {os.path.abspath(video_path)}")
-    exit()
-
-# Get video properties
-width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-fps = int(cap.get(cv2.CAP_PROP_FPS))
-total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-print(f"Video loaded: {width}x{height}, {fps} FPS, {total_frames} frames")
-
-# Output video setup
-output_path = 'output_video.avi'
-fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # MJPG for Windows compatibility
-out = cv2.VideoWriter(output_path, fourcc, fps, (width, height), isColor=True)
-
-# Check if writer is opened
-if not out.isOpened():
-    print("Error: Could not open output video writer.")
-    cap.release()
-    exit()
+import cv2
+import numpy as np
 
-# Parameters for bird detection
-min_area = 50  # Minimum area of detected birds
-max_area = 500  # Maximum area to avoid large objects
+from render_tracks import draw_circles
+from track_io import TrackWriter
+from video_io import VideoReader, VideoWriter
 
-# Initialize trackers (CSRT for accuracy)
-trackers = []
-max_trackers = 3  # Track up to 3 birds
 
 def create_tracker():
     return cv2.TrackerCSRT_create()
 
-# Process frames
-frame_count = 0
-birds_detected = False
-
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    frame_count += 1
-    print(f'Processing frame {frame_count}/{total_frames}')
-
-    # Convert to grayscale and apply background subtraction
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blurred, 100, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-    # Find contours
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    # Initialize trackers for detected birds
-    if not birds_detected and len(trackers) < max_trackers:
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if min_area < area < max_area:
-                (x, y, w, h) = cv2.boundingRect(contour)
-                tracker = create_tracker()
-                try:
-                    tracker.init(frame, (x, y, w, h))
-                    trackers.append(tracker)
-                    if len(trackers) >= max_trackers:
-                        birds_detected = True
-                        break
-                except Exception as e:
-                    print(f"Warning: Tracker init failed: {e}")
-
-    # Update trackers and draw circles
-    for tracker in trackers:
-        success, box = tracker.update(frame)
-        if success:
-            (x, y, w, h) = [int(v) for v in box]
-            center = (x + w // 2, y + h // 2)
-            radius = max(w, h) // 2 + 5
-            cv2.circle(frame, center, radius, (0, 255, 0), 2)
-
-    # Write frame to output
-    out.write(frame)
-
-# Release resources
-cap.release()
-out.release()
-cv2.destroyAllWindows()
-print(f'Output saved to {output_path}')
\ No newline at end of file
+
+class BirdDetector(object):
+    """
+    Contour detection on a copy of the frame shrunk by scale. With background='average' or 'mog2' the
+    foreground is whatever differs from a running background model (an exponential average, or OpenCV's
+    MOG2 mixture model) instead of the dark side of an Otsu split, so a sky that darkens or clouds over does
+    not flood the mask. The background has to see every frame: call update on each frame, and detect only
+    when new birds are needed. Areas are given and boxes returned in full-resolution pixels.
+    """
+
+    def __init__(self, min_area=50, max_area=500, scale=0.5, background='average', learning_rate=0.05,
+                 threshold=25):
+        self.min_area = min_area
+        self.max_area = max_area
+        self.scale = scale
+        self.background = background
+        self.learning_rate = learning_rate
+        self.threshold = threshold
+        self.model = None
+        self.mask = None
+        if background == 'mog2':
+            self.model = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+
+    def update(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # OpenCV halves an image by area averaging much faster than it shrinks it by other factors
+        scale = self.scale
+        while scale <= 0.5:
+            gray = cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+            scale *= 2
+        if scale != 1:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        if self.background == 'mog2':
+            self.mask = self.model.apply(blurred, learningRate=self.learning_rate)
+        elif self.background == 'average' and self.model is not None:
+            diff = cv2.absdiff(blurred.astype(np.float32), self.model)
+            self.mask = (diff > self.threshold).astype(np.uint8) * 255
+            cv2.accumulateWeighted(blurred, self.model, self.learning_rate)
+        else:
+            # the first frame has no background yet, so it gets the static Otsu split
+            _, self.mask = cv2.threshold(blurred, 100, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+            if self.background == 'average':
+                self.model = blurred.astype(np.float32)
+
+    def detect(self):
+        contours, _ = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        area_scale = self.scale ** 2
+        return [tuple(int(round(v / self.scale)) for v in cv2.boundingRect(contour)) for contour in contours
+                if self.min_area * area_scale < cv2.contourArea(contour) < self.max_area * area_scale]
+
+
+def overlaps(box, boxes):
+    x, y, w, h = box
+    return any(x < bx + bw and bx < x + w and y < by + bh and by < y + h for bx, by, bw, bh in boxes)
+
+
+class TrackerSet(object):
+    """
+    Up to max_trackers CSRT trackers, updated in parallel on a thread pool (OpenCV releases the GIL while a
+    tracker updates). A tracker that fails max_failures frames in a row is dropped, which frees its slot for
+    the next bird that detection finds. Every tracker started gets a new ID, counting from 1.
+    """
+
+    def __init__(self, max_trackers=20, max_failures=5, workers=None):
+        self.max_trackers = max_trackers
+        self.max_failures = max_failures
+        self.trackers = []
+        self.failures = []
+        self.boxes = []
+        self.ids = []
+        self.next_id = 1
+        self.pool = ThreadPoolExecutor(workers or os.cpu_count())
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def free_slots(self):
+        return self.max_trackers - len(self.trackers)
+
+    def add(self, frame, boxes):
+        """
+        Starts trackers on the boxes that no tracker covers yet, while there are free slots.
+        """
+        for box in boxes:
+            if self.free_slots() <= 0:
+                break
+            if overlaps(box, self.boxes):
+                continue
+            tracker = create_tracker()
+            try:
+                tracker.init(frame, tuple(int(v) for v in box))
+            except Exception as e:
+                print(f"Warning: Tracker init failed: {e}")
+                continue
+            self.trackers.append(tracker)
+            self.failures.append(0)
+            self.boxes.append(tuple(box))
+            self.ids.append(self.next_id)
+            self.next_id += 1
+
+    def update(self, frame):
+        """
+        Updates every tracker on the frame and returns the (x, y, w, h, id) of those that succeeded.
+        """
+        results = list(self.pool.map(lambda tracker: tracker.update(frame), self.trackers))
+        tracked = []
+        keep = []
+        for i, (success, box) in enumerate(results):
+            if success:
+                self.failures[i] = 0
+                self.boxes[i] = tuple(box)
+                tracked.append(tuple(int(v) for v in box) + (self.ids[i],))
+            else:
+                self.failures[i] += 1
+            keep.append(self.failures[i] < self.max_failures)
+        self.trackers = [t for t, k in zip(self.trackers, keep) if k]
+        self.failures = [f for f, k in zip(self.failures, keep) if k]
+        self.boxes = [b for b, k in zip(self.boxes, keep) if k]
+        self.ids = [t for t, k in zip(self.ids, keep) if k]
+        return tracked
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Track birds with contour detection and CSRT trackers')
+    parser.add_argument("--input", help="Input video.", type=str, default='input.mp4')
+    parser.add_argument("--output", help="Annotated output video.", type=str, default='output_video.avi')
+    parser.add_argument("--max_trackers", help="Most birds tracked at once.", type=int, default=20)
+    parser.add_argument("--max_failures", help="Drop a tracker after this many failed frames in a row.", type=int,
+                        default=5)
+    parser.add_argument("--workers", help="Threads updating the trackers (default: one per CPU).", type=int,
+                        default=None)
+    parser.add_argument("--min_area", help="Minimum area of detected birds.", type=float, default=50)
+    parser.add_argument("--max_area", help="Maximum area to avoid large objects.", type=float, default=500)
+    parser.add_argument("--scale", help="Detect on a copy of the frame scaled by this factor, at most 1.",
+                        type=float, default=0.5)
+    parser.add_argument("--background", help="Foreground model: a running average, OpenCV's MOG2, or none for a "
+                                             "static Otsu split of every frame.", type=str,
+                        choices=['average', 'mog2', 'none'], default='average')
+    parser.add_argument("--learning_rate", help="How fast the background model adapts.", type=float, default=0.05)
+    parser.add_argument("--tracks", help="Stream the tracks to this MOT text file, or compact binary file if it ends "
+                                         "in .bin (default: the output path with .txt with --no_video, else none).",
+                        type=str, default=None)
+    parser.add_argument('--no_video', dest='no_video',
+                        help='Only write the tracks, skipping drawing and encoding; render_tracks.py --style csrt '
+                             'can draw them later [False]', action='store_true')
+    parser.add_argument("--prefetch", help="Frames decoded ahead and queued for encoding.", type=int, default=16)
+    parser.add_argument("--progress_every", help="Seconds between progress lines.", type=float, default=5.)
+    args = parser.parse_args()
+    if not 0 < args.scale <= 1:
+        parser.error("--scale must be greater than 0 and at most 1, got %g" % args.scale)
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Load video
+    video_path = args.input
+    if not os.path.exists(video_path):
+        print(f"Error: Video file '{video_path}' does not exist.")
+        exit()
+
+    # Explicit FFMPEG backend, decoding ahead of the trackers on a background thread
+    cap = VideoReader(video_path, prefetch=args.prefetch, api_preference=cv2.CAP_FFMPEG)
+
+    # Check if video opened
+    if not cap.isOpened():
+        print("Error: Could not open input video. Check file format or OpenCV FFMPEG support.")
+        print(f"File path: {os.path.abspath(video_path)}")
+        exit()
+
+    # Get video properties
+    width, height = cap.size
+    fps = int(cap.fps)
+    total_frames = cap.frame_count
+    print(f"Video loaded: {width}x{height}, {fps} FPS, {total_frames} frames")
+
+    # Output video setup
+    output_path = args.output
+    out = None
+    if not args.no_video:
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # MJPG for Windows compatibility
+        out = VideoWriter(output_path, fourcc, fps, (width, height), queue_size=args.prefetch, is_color=True)
+
+        # Check if writer is opened
+        if not out.isOpened():
+            print("Error: Could not open output video writer.")
+            out.release()
+            cap.release()
+            exit()
+
+    # Tracks are streamed to the track file frame by frame
+    tracks_path = args.tracks or (os.path.splitext(output_path)[0] + '.txt' if args.no_video else None)
+    tracks_out = None if tracks_path is None else TrackWriter(tracks_path)
+
+    # Initialize trackers (CSRT for accuracy)
+    trackers = TrackerSet(args.max_trackers, args.max_failures, args.workers)
+
+    detector = BirdDetector(args.min_area, args.max_area, args.scale, args.background, args.learning_rate)
+
+    # Process frames
+    frame_count = 0
+    start_time = last_progress = time.time()
+
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        frame_count += 1
+        if time.time() - last_progress >= args.progress_every or frame_count == total_frames:
+            last_progress = time.time()
+            print(f'Processing frame {frame_count}/{total_frames} '
+                  f'({frame_count / (last_progress - start_time):.1f} FPS, {len(trackers)} trackers)')
+
+        # Detect birds to fill the slots of trackers that were dropped or never started
+        detector.update(frame)
+        if trackers.free_slots() > 0:
+            trackers.add(frame, detector.detect())
+
+        # Update trackers
+        tracked = np.array(trackers.update(frame), dtype=float).reshape(-1, 5)
+        if tracks_out is not None:
+            tracks_out.write(frame_count, np.column_stack((tracked[:, :2], tracked[:, :2] + tracked[:, 2:4],
+                                                           tracked[:, 4])))
+
+        # Draw circles and write frame to output
+        if out is not None:
+            draw_circles(frame, tracked[:, :4].astype(int))
+            out.write(frame)
+
+    # Release resources
+    trackers.close()
+    cap.release()
+    if tracks_out is not None:
+        tracks_out.close()
+        print(f'Tracks saved to {tracks_path}')
+    if out is not None:
+        out.release()
+        cv2.destroyAllWindows()
+        print(f'Output saved to {output_path}')
@@ -1,87 +1,503 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 import numpy as np
 import torch
-from torchvision import transforms
-from torchvision.models.detection import fasterrcnn_resnet50_fpn
-from sort import Sort
+from bird_detector import (MODELS, PROFILES, DetectionCache, FrameTensors, MotionGatedDetector, filter_birds, load_model,
+                           model_key, run_model)
+from render_tracks import draw_tracks
+from sort import DetectionStride, Sort, TrajectoryStore, save_state, stitch_tracks
 from tqdm import tqdm
+from track_io import TrackWriter
+from video_io import VideoReader, VideoWriter, video_properties
+
+
+def segment_path(output_path, index):
+    root, ext = os.path.splitext(output_path)
+    return '%s.part%04d%s' % (root, index, ext)
+
+
+def concatenate_segments(segment_paths, output_path, fourcc, fps, size):
+    # Join the per-checkpoint segments into one video; re-encoding is cheap next to detection
+    out = VideoWriter(output_path, fourcc, fps, size)
+    for path in segment_paths:
+        with VideoReader(path) as reader:
+            for frame in reader:
+                out.write(frame)
+    out.release()
+
+
+class Pipeline(object):
+    """
+    Runs stage functions on their own threads, connected by bounded FIFO queues, so frames stay in
+    order. When a stage fails, the others stop and the error is raised from run().
+    """
+    END = object()
+
+    def __init__(self):
+        self.stop = threading.Event()
+        self.errors = []
+
+    def put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, q):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return self.END
+
+    def _run_stage(self, target, output):
+        try:
+            target()
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            if output is not None:
+                self.put(output, self.END)
+
+    def run(self, stages):
+        """
+        stages is a list of (target, output_queue) pairs; END is put on output_queue when target returns.
+        """
+        threads = [threading.Thread(target=self._run_stage, args=stage, daemon=True) for stage in stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+def resolve_profile(args, device):
+    # The profile picks the detector configuration; explicit flags override it
+    profile = dict(PROFILES[args.profile])
+    if args.model is not None:
+        profile['model'] = args.model
+    if args.input_size is not None:
+        profile['input_size'] = args.input_size
+    profile['quantize'] = (profile['quantize'] or args.quantize) and device.type == 'cpu'
+    return profile
+
+
+def track_shard(args, start, stop):
+    """
+    Detects and tracks frames start <= frame < stop of the input video with a fresh Sort, for --shards.
+    Returns the reported tracks as TrajectoryStore columns, numbered by frame of the whole video.
+    """
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.shards)
+    tracks = TrajectoryStore()
+    track_video(argparse.Namespace(**dict(vars(args), threads=threads)), start, stop, tracks)
+    columns = {name: np.array(column) for name, column in tracks.columns().items()}
+    columns['frame'] += start - 1  # Sort counts the frames of the shard from 1
+    return columns
+
+
+def tracks_file(args):
+    # Sharded and video-less runs always keep the tracks, by default next to the output video
+    if args.tracks or args.shards > 1 or args.no_video:
+        return args.tracks or os.path.splitext(args.output)[0] + '.txt'
+    return None
+
+
+def stitch_shards(shards, cuts, half):
+    """
+    Joins the tracks of the shards of run_sharded, each shard's between its two cuts, into rows of
+    [frame, id, x1, y1, x2, y2] for the whole video. Tracks stitched across a cut, within half frames of it,
+    keep one ID, and IDs are numbered from 1 over the tracks that have rows.
+    """
+    # Label the tracks of the whole video, carrying labels over the cuts where tracks were stitched
+    next_label = 0
+    previous = None
+    rows = []
+    for i, tracks in enumerate(shards):
+        labels = {}
+        if i > 0:
+            for a, b in stitch_tracks(shards[i - 1], tracks, cuts[i] - half, cuts[i] + half):
+                labels[b] = previous[a]
+        for track_id in np.unique(tracks['id']):
+            if track_id not in labels:
+                labels[track_id] = next_label
+                next_label += 1
+        own = (tracks['frame'] >= cuts[i]) & ((tracks['frame'] < cuts[i + 1]) | (i == len(shards) - 1))
+        rows.append(np.column_stack((tracks['frame'][own], [labels[t] for t in tracks['id'][own]],
+                                     tracks['box'][own])).reshape(-1, 6))
+        previous = labels
+    rows = np.concatenate(rows)
+    # Number only the tracks that were written, in label order; tracks seen only in an overlap take no ID
+    rows[:, 1] = np.unique(rows[:, 1], return_inverse=True)[1] + 1
+    return rows
+
+
+def run_sharded(args):
+    """
+    Splits the video into --shards frame ranges and tracks each in its own process. The ranges overlap by
+    --shard_overlap frames, where the track IDs of neighbouring shards are stitched together. Then the
+    track file of the whole video and, unless --no_video, the annotated video are written.
+    """
+    fps, (width, height), total_frames = video_properties(args.input)
 
-# Set up device (GPU if available, else CPU)
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # Each shard owns the frames between two cuts and also tracks half the overlap on either side of them
+    cuts = np.linspace(0, total_frames, args.shards + 1).round().astype(int)
+    half = args.shard_overlap // 2
+    starts = [max(0, cut - half) for cut in cuts[:-1]]
+    stops = [min(total_frames, cut + half) for cut in cuts[1:]]
+    stops[-1] = sys.maxsize  # the frame count of some containers is only an estimate
+    # spawned workers, as forking a process that has already started torch's thread pools is unsafe
+    with ProcessPoolExecutor(args.shards, mp_context=multiprocessing.get_context('spawn')) as executor:
+        shards = list(tqdm(executor.map(track_shard, [args] * args.shards, starts, stops), total=args.shards,
+                           desc='shards'))
 
-# Load the pre-trained Faster R-CNN model and move to device
-model = fasterrcnn_resnet50_fpn(pretrained=True).to(device)
-model.eval()
+    rows = stitch_shards(shards, cuts, half)
+    birds = len(np.unique(rows[:, 1]))
 
-# Initialize the SORT tracker
-tracker = Sort()
+    tracks_path = tracks_file(args)
+    with TrackWriter(tracks_path) as tracks_out:
+        tracks_out.write(rows[:, 0] + 1, rows[:, [2, 3, 4, 5, 1]])
+    if args.no_video:
+        print(f"Tracks of {birds} birds saved to {tracks_path}")
+        return
 
-# Define the transformation to convert frame to tensor
-transform = transforms.Compose([transforms.ToTensor()])
+    # Render the stitched tracks onto the video
+    reader = VideoReader(args.input, prefetch=args.queue_size)
+    out = VideoWriter(args.output, 'mp4v', fps, (width, height), queue_size=args.queue_size)
+    frame_index = 0
+    with tqdm(total=total_frames, desc='render') as bar:
+        for frame in reader:
+            lo, hi = np.searchsorted(rows[:, 0], [frame_index, frame_index + 1])
+            draw_tracks(frame, rows[lo:hi, [2, 3, 4, 5, 1]])
+            out.write(frame)
+            frame_index += 1
+            bar.update(1)
+    reader.release()
+    out.release()
+    print(f"Tracks of {birds} birds saved to {tracks_path}")
 
-# Open the input video
-cap = cv2.VideoCapture('input.mp4')
-width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-fps = cap.get(cv2.CAP_PROP_FPS)
-total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-# Set up the output video writer
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-out = cv2.VideoWriter('output.mp4', fourcc, fps, (width, height))
+def track_video(args, start=0, stop=None, trajectories=None):
+    """
+    Detects and tracks the birds of args.input in a pipeline of read, detect, track and write threads, and
+    writes the annotated video and, if asked for, the track file. With --checkpoint_every, an interrupted
+    run resumes from its last checkpoint and writes the same output as an uninterrupted one.
 
-# Initialize progress bar
-pbar = tqdm(total=total_frames, desc="Processing frames")
+    A shard of --shards only tracks frames start <= frame < stop and, instead of writing any files, records
+    the reported tracks in the trajectories TrajectoryStore, numbered by the frame of the shard from 1.
+    """
+    shard = trajectories is not None
 
-# Process each frame
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
+    # Set up device (GPU if available, else CPU)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-    # Convert frame to tensor and move to device
-    frame_tensor = transform(frame).unsqueeze(0).to(device)
+    # Initialize the SORT tracker
+    tracker = Sort(trajectories=trajectories)
 
-    # Run the model to get detections
-    with torch.no_grad():
-        predictions = model(frame_tensor)
+    # Converts frames to RGB tensors in a batch buffer that is reused for every batch
+    transform = FrameTensors(device)
 
-    # Extract boxes, labels, and scores
-    boxes = predictions[0]['boxes'].cpu().numpy()
-    labels = predictions[0]['labels'].cpu().numpy()
-    scores = predictions[0]['scores'].cpu().numpy()
+    # Resume from the last checkpoint, if there is one. Each checkpoint closes a segment of the output video,
+    # so frames before it never need to be detected again.
+    checkpointing = args.checkpoint_every > 0 and not shard
+    checkpoint_path = args.output + '.ckpt.npz'
+    start_frame = start
+    start_segment = 0
+    tracks_path = None if shard else tracks_file(args)
+    tracks_offset = None
+    state = None
+    if checkpointing and os.path.exists(checkpoint_path):
+        state = tracker.load(checkpoint_path)
+        start_frame = int(state['next_frame'])
+        start_segment = int(state['segments'])
+        if tracks_path is not None:
+            if 'tracks_offset' not in state:
+                sys.exit(f"The checkpoint {checkpoint_path} was written without a track file; delete it to start over")
+            tracks_offset = int(state['tracks_offset'])
+        print(f"Resuming from checkpoint at frame {start_frame}")
+    # The tracks of every frame go to the track file as soon as they are known; a resumed run cuts off the
+    # rows written after its checkpoint
+    tracks_out = None if tracks_path is None else TrackWriter(tracks_path, tracks_offset)
 
-    # Filter detections for birds (COCO class 16) with confidence > 0.5
-    bird_indices = np.where((labels == 16) & (scores > 0.2))[0]
-    detections = boxes[bird_indices]
-    det_scores = scores[bird_indices]
+    # Open the input video; it is decoded ahead on a background thread
+    cap = VideoReader(args.input, prefetch=args.queue_size, start=start_frame,
+                      count=None if stop is None else stop - start_frame)
+    width, height = cap.size
+    fps = cap.fps
+    total_frames = cap.source_frame_count
 
-    # Prepare detections for tracker: [x1, y1, x2, y2, score]
-    if len(detections) > 0:
-        detections_for_tracker = np.hstack((detections, det_scores.reshape(-1, 1)))
+    profile = resolve_profile(args, device)
+
+    # Raw detections are cached per video, model configuration and resolution; a cache hit skips the model entirely.
+    # The cache holds full-frame detections, so --roi neither reads nor writes it.
+    cache = None
+    cached = False
+    if not args.no_cache and not args.roi:
+        cache = DetectionCache(args.cache_dir, args.input, model_key(profile['model'], profile['input_size'],
+                                                                     profile['quantize']), (width, height))
+        cached = cache.exists()
+        if cached:
+            cache.load()
+            print(f"Using cached detections from {cache.path}")
+    # Keyframe scheduling: the tracking stage owns the stride policy and, when it adapts, reports the next
+    # keyframe after every keyframe back to the detection stage, which waits for it before reading on.
+    # Keyframes are absolute frame indices, every min_stride-th frame from frame 0 for a fixed stride, and a
+    # checkpoint keeps the next one and the stride, so a resumed run detects on the same frames.
+    stride = DetectionStride(args.detect_every, args.max_stride)
+    adaptive = stride.max_stride > stride.min_stride
+    strides = queue.Queue()
+    first_keyframe = -(-start_frame // stride.min_stride) * stride.min_stride
+    if state is not None:
+        stride.load_state_dict(state)
+        first_keyframe = int(state.get('next_keyframe', first_keyframe))
+    recording = cache is not None and not cached and start_frame == 0 and stop is None and stride.max_stride == 1
+    model = None if cached else load_model(device, profile['model'], profile['input_size'], profile['quantize'],
+                                           args.threads, None if args.no_model_cache else args.model_cache)
+
+    # Set up the output video writer
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+
+    # One progress bar per stage shows which one is the bottleneck; shards only report when they are done
+    write_video = not args.no_video and not shard
+    stage_names = ['read', 'detect', 'track'] + (['write'] if write_video else [])
+    bars = {name: tqdm(total=total_frames, initial=start_frame, desc=name.ljust(9), position=i, disable=shard)
+            for i, name in enumerate(stage_names)}
+
+    pipeline = Pipeline()
+    decoded = queue.Queue(maxsize=args.queue_size)
+    detected = queue.Queue(maxsize=args.queue_size)
+    annotated = queue.Queue(maxsize=args.queue_size)
+
+    def read_frames():
+        for frame in cap:
+            if pipeline.stop.is_set():
+                break
+            pipeline.put(decoded, frame)
+            bars['read'].update(1)
+
+    # With --roi, a cheap motion stage decides where the detector looks; frames without motion skip it entirely
+    if args.roi:
+        detect = MotionGatedDetector(model, device, transform, (width, height), args.full_frame_every, args.crop_size,
+                                     args.max_zoom)
+    else:
+        detect = lambda images: run_model(model, images, device, transform)
+
+    def run_detection():
+        frame_index = start_frame
+        next_keyframe = first_keyframe
+        # the next keyframe depends on the tracker when the stride adapts, so keyframes are detected one at a time
+        batch_size = 1 if adaptive else args.batch_size
+        done = False
+        while not done:
+            # Gather frames up to the batch_size-th keyframe, then run the model once on all the keyframes
+            frames = []
+            keyframes = []
+            while len(keyframes) < batch_size:
+                frame = pipeline.get(decoded)
+                if frame is Pipeline.END:
+                    done = True
+                    break
+                if frame_index + len(frames) == next_keyframe:
+                    keyframes.append(len(frames))
+                    next_keyframe += stride.min_stride
+                frames.append(frame)
+            if not frames:
+                continue
+            raw = []
+            if cached:
+                raw = [cache[frame_index + i] for i in keyframes]
+            elif keyframes:
+                raw = detect([frames[i] for i in keyframes])
+                if recording:
+                    for boxes, labels, scores in raw:
+                        cache.append(boxes, labels, scores)
+            detections = [None] * len(frames)
+            for i, (boxes, labels, scores) in zip(keyframes, raw):
+                detections[i] = filter_birds(boxes, labels, scores, args.score_threshold)
+            for frame, dets in zip(frames, detections):
+                pipeline.put(detected, (frame, dets))
+            if adaptive and keyframes:
+                next_keyframe = pipeline.get(strides)
+                if next_keyframe is Pipeline.END:
+                    break
+            frame_index += len(frames)
+            bars['detect'].update(len(frames))
+
+    def run_tracking():
+        frame_index = start_frame
+        next_keyframe = first_keyframe
+        while True:
+            item = pipeline.get(detected)
+            if item is Pipeline.END:
+                break
+            frame, detections_for_tracker = item
+
+            if detections_for_tracker is None:
+                # No detector pass on this frame, move the tracks along their predicted paths
+                tracked_objects = tracker.coast()
+            else:
+                # Update the tracker with detections
+                tracked_objects = tracker.update(detections_for_tracker)
+                next_keyframe = frame_index + stride.update(tracker)
+                if adaptive:
+                    strides.put(next_keyframe)
+            if tracks_out is not None:
+                tracks_out.write(frame_index + 1, tracked_objects)
+            if write_video:
+                draw_tracks(frame, tracked_objects)
+                pipeline.put(annotated, frame)
+            frame_index += 1
+
+            if checkpointing and frame_index % args.checkpoint_every == 0:
+                state = {name: np.array(value, copy=True) for name, value in tracker.state_dict().items()}
+                state.update(stride.state_dict(), next_keyframe=next_keyframe)
+                if tracks_out is not None:
+                    state['tracks_offset'] = tracks_out.tell()
+                if not write_video:
+                    save_state(checkpoint_path, dict(state, next_frame=frame_index, segments=0))
+                else:
+                    # Ask the writer to close the current segment and checkpoint this tracker state
+                    pipeline.put(annotated, (frame_index, state))
+            bars['track'].update(1)
+
+    def write_frames():
+        segment = start_segment
+        out = VideoWriter(segment_path(args.output, segment) if checkpointing else args.output, fourcc, fps,
+                          (width, height), queue_size=args.queue_size)
+        try:
+            while True:
+                item = pipeline.get(annotated)
+                if item is Pipeline.END:
+                    break
+                if isinstance(item, tuple):
+                    # Checkpoint only once every frame before it is safely in a closed segment
+                    frame_index, state = item
+                    out.release()
+                    segment += 1
+                    save_state(checkpoint_path, dict(state, next_frame=frame_index, segments=segment))
+                    out = VideoWriter(segment_path(args.output, segment), fourcc, fps, (width, height),
+                                      queue_size=args.queue_size)
+                    continue
+
+                # Write the annotated frame to the output video
+                out.write(item)
+                bars['write'].update(1)
+        finally:
+            out.release()
+        return segment
+
+    segments = []
+    if not write_video:
+        pipeline.run([(read_frames, decoded), (run_detection, detected), (run_tracking, None)])
     else:
-        detections_for_tracker = np.empty((0, 5))
-
-    # Update the tracker with detections
-    tracked_objects = tracker.update(detections_for_tracker)
-
-    # Draw orange circles for each tracked bird
-    for obj in tracked_objects:
-        x1, y1, x2, y2, track_id = obj
-        center_x = (x1 + x2) / 2
-        center_y = (y1 + y2) / 2
-        w = x2 - x1
-        h = y2 - y1
-        radius = np.sqrt((w / 2) ** 2 + (h / 2) ** 2)
-        cv2.circle(frame, (int(center_x), int(center_y)), int(radius), (0, 165, 255), 2)
-
-    # Write the annotated frame to the output video
-    out.write(frame)
-
-    # Update the progress bar
-    pbar.update(1)
-
-# Close the progress bar and release resources
-pbar.close()
-cap.release()
-out.release()
\ No newline at end of file
+        pipeline.run([(read_frames, decoded), (run_detection, detected), (run_tracking, annotated),
+                      (lambda: segments.append(write_frames()), None)])
+
+    # Close the progress bars and release resources
+    for bar in bars.values():
+        bar.close()
+    cap.release()
+    if tracks_out is not None:
+        tracks_out.close()
+
+    if recording:
+        cache.save()
+
+    if isinstance(detect, MotionGatedDetector):
+        print("Detector passes: {full} full frame, {crops} on crops, {skipped} skipped".format(**detect.counts))
+
+    if checkpointing and not write_video:
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    elif checkpointing:
+        segment_paths = [segment_path(args.output, i) for i in range(segments[0] + 1)]
+        concatenate_segments(segment_paths, args.output, fourcc, fps, (width, height))
+        for path in segment_paths:
+            os.remove(path)
+        # a video shorter than --checkpoint_every never got a checkpoint
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    if tracks_path is not None:
+        print(f"Tracks saved to {tracks_path}")
+
+
+def parse_args(argv=None):
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Track birds with Faster R-CNN and SORT')
+    parser.add_argument("--input", help="Input video.", type=str, default='input.mp4')
+    parser.add_argument("--output", help="Annotated output video.", type=str, default='output.mp4')
+    parser.add_argument("--checkpoint_every",
+                        help="Checkpoint the tracker every N frames and resume from the last checkpoint after a "
+                             "crash (0 disables checkpoints).",
+                        type=int, default=0)
+    parser.add_argument("--batch_size", help="Frames per inference batch.", type=int, default=4)
+    parser.add_argument("--queue_size", help="Frames buffered between pipeline stages.", type=int, default=16)
+    parser.add_argument("--score_threshold", help="Minimum detector score for a bird.", type=float, default=0.2)
+    parser.add_argument("--profile", help="Inference profile: %s." % ', '.join(
+        '%s (%s%s%s)' % (name, p['model'], '' if p['input_size'] is None else ' at %d' % p['input_size'],
+                         ', int8' if p['quantize'] else '') for name, p in sorted(PROFILES.items())),
+                        type=str, choices=sorted(PROFILES), default='accurate')
+    parser.add_argument("--model", help="Override the profile's detector.", type=str, choices=sorted(MODELS),
+                        default=None)
+    parser.add_argument("--input_size", help="Override the short side frames are scaled to before the detector.",
+                        type=int, default=None)
+    parser.add_argument('--quantize', dest='quantize', help="Use dynamic int8 quantization on CPU whatever the "
+                                                            "profile says [False]", action='store_true')
+    parser.add_argument("--threads", help="Intra-op threads for the detector (default: torch's choice).", type=int,
+                        default=None)
+    parser.add_argument("--model_cache", help="Directory of prepared TorchScript models.", type=str,
+                        default='.model_cache')
+    parser.add_argument('--no_model_cache', dest='no_model_cache',
+                        help='Build the model from torchvision on every start [False]', action='store_true')
+    parser.add_argument("--shards", help="Split the video into this many overlapping frame ranges and track them in "
+                                         "parallel processes (1 disables sharding).", type=int, default=1)
+    parser.add_argument("--shard_overlap", help="Frames tracked by both shards around each cut, to stitch IDs.",
+                        type=int, default=30)
+    parser.add_argument("--tracks", help="Stream the tracks to this MOT text file, or compact binary file if it ends "
+                                         "in .bin (default: the output path with .txt when sharded or with "
+                                         "--no_video, else none).", type=str, default=None)
+    parser.add_argument('--no_video', dest='no_video',
+                        help='Only write the tracks, skipping drawing and encoding; render_tracks.py can draw them '
+                             'later [False]', action='store_true')
+    parser.add_argument("--cache_dir", help="Directory of the raw detection cache.", type=str,
+                        default='.detection_cache')
+    parser.add_argument("--detect_every",
+                        help="Run the detector on every Nth frame only; the tracker coasts on Kalman predictions "
+                             "in between.", type=int, default=1)
+    parser.add_argument("--max_stride",
+                        help="Adapt the detection stride between --detect_every and this many frames, shrinking it "
+                             "when birds appear or are lost and growing it while the scene is stable (0 keeps the "
+                             "stride fixed).", type=int, default=0)
+    parser.add_argument('--roi', dest='roi',
+                        help='Only run the detector on crops around moving regions, with a periodic full-frame pass '
+                             '[False]', action='store_true')
+    parser.add_argument("--full_frame_every", help="With --roi, detect on the whole frame every Nth detector pass.",
+                        type=int, default=25)
+    parser.add_argument("--crop_size", help="With --roi, the size the detector scales each crop to.", type=int,
+                        default=320)
+    parser.add_argument("--max_zoom", help="With --roi, the largest upscale of a crop around a small bird.",
+                        type=float, default=4.)
+    parser.add_argument('--no_cache', dest='no_cache', help='Neither read nor write the detection cache [False]',
+                        action='store_true')
+    args = parser.parse_args(argv)
+    if args.shards > 1 and args.checkpoint_every:
+        parser.error("--checkpoint_every is not supported with --shards")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.shards > 1:
+        sys.exit(run_sharded(args))
+    track_video(args)
@@ -0,0 +1,86 @@
+"""
+Track files for the bird trackers. TrackWriter streams the tracks of each frame to disk as they are found,
+so a run can skip drawing and encoding video altogether, and read_tracks loads them back, for example for
+render_tracks.py. Two formats share the same fields:
+
+    MOT text (any extension)   1,3,120.50,64.00,18.25,12.00,1,-1,-1,-1   frame,id,x,y,w,h as sort.py writes
+    binary (.bin)              24-byte little-endian TRACK_DTYPE records, about half the size and much faster
+"""
+import os
+import warnings
+
+import numpy as np
+
+TRACK_DTYPE = np.dtype([('frame', '<i4'), ('id', '<i4'), ('box', '<f4', (4,))])
+
+
+def is_binary(path):
+    return os.path.splitext(path)[1].lower() == '.bin'
+
+
+class TrackWriter(object):
+    """
+    Appends tracks to a track file, in MOT text or, for a .bin path, binary TRACK_DTYPE records. With
+    resume_at, an existing file is cut back to that byte offset, as returned by tell at a checkpoint, and
+    written on from there; otherwise the file is started over.
+    """
+
+    def __init__(self, path, resume_at=None):
+        self.path = path
+        self.binary = is_binary(path)
+        if resume_at is None:
+            self.file = open(path, 'wb')
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(resume_at)
+            self.file.seek(resume_at)
+
+    def write(self, frame, tracks):
+        """
+        Writes Nx5 [x1,y1,x2,y2,id] tracks in the format Sort.update returns. frame is the 1-based MOT frame
+        number of all of them, or an array with the frame of each.
+        """
+        if len(tracks) == 0:
+            return
+        tracks = np.asarray(tracks, dtype=float)
+        frames = np.broadcast_to(frame, (len(tracks),))
+        if self.binary:
+            rows = np.empty(len(tracks), TRACK_DTYPE)
+            rows['frame'] = frames
+            rows['id'] = tracks[:, 4]
+            rows['box'][:, :2] = tracks[:, :2]
+            rows['box'][:, 2:] = tracks[:, 2:4] - tracks[:, :2]
+            self.file.write(rows.tobytes())
+        else:
+            self.file.write(''.join('%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1\n' % (f, d[4], d[0], d[1], d[2] - d[0],
+                                                                                d[3] - d[1])
+                                    for f, d in zip(frames, tracks)).encode())
+
+    def tell(self):
+        """
+        Flushes the file and returns its size, the offset to resume from.
+        """
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_tracks(path):
+    """
+    Reads a track file written by TrackWriter or sort.py. Returns an Nx6 array of [frame, id, x, y, w, h]
+    rows in file order.
+    """
+    if is_binary(path):
+        rows = np.fromfile(path, TRACK_DTYPE)
+        return np.column_stack((rows['frame'], rows['id'], rows['box'])).astype(float).reshape(-1, 6)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # an empty file is a video without birds
+        return np.loadtxt(path, delimiter=',', usecols=range(6), ndmin=2).reshape(-1, 6)
@@ -0,0 +1,186 @@
+"""
+Threaded video reading and writing for the video tools. VideoReader decodes on a background thread into a
+bounded queue, so decoding overlaps with whatever the caller does with the frames, and can skip or shrink
+frames as they are decoded. VideoWriter encodes on a background thread in the same way.
+
+    reader = VideoReader('input.mp4', skip=2, scale=0.5)
+    writer = VideoWriter('output.mp4', 'mp4v', reader.fps, reader.size)
+    for frame in reader:
+        writer.write(frame)
+    writer.release()
+"""
+import math
+import queue
+import threading
+
+import cv2
+
+_END = object()
+
+
+def video_properties(path):
+    """
+    Returns the fps, (width, height) and frame count the container reports for a video.
+    """
+    cap = cv2.VideoCapture(path)
+    properties = (cap.get(cv2.CAP_PROP_FPS) or 30.0,
+                  (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))),
+                  int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    cap.release()
+    return properties
+
+
+class VideoReader(object):
+    """
+    Iterates over the frames of a video, decoded ahead by a background thread into a queue of at most
+    prefetch frames. Starts at frame start and keeps it and every skip-th frame after it (the others are only
+    grabbed, not decoded into images), resizes the kept frames by scale and stops after count frames if count
+    is given.
+    fps, size and frame_count describe the frames as they come out of the reader, not the source.
+    """
+
+    def __init__(self, path, prefetch=16, skip=1, scale=1., start=0, count=None, api_preference=cv2.CAP_ANY):
+        self.cap = cv2.VideoCapture(path, api_preference)
+        self.skip = max(1, skip)
+        self.scale = scale
+        self.source_fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.source_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.source_frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.source_fps / self.skip
+        self.size = self.source_size if scale == 1 else (int(round(self.source_size[0] * scale)),
+                                                         int(round(self.source_size[1] * scale)))
+        # the container's frame count is an estimate for some formats; frames_read is exact once the reader is done
+        self.frame_count = max(0, int(math.ceil((self.source_frame_count - start) / float(self.skip))))
+        if count is not None:
+            self.frame_count = min(self.frame_count, count)
+        self.count = count
+        self.frames_read = 0
+        if start > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        self._queue = queue.Queue(maxsize=max(1, prefetch))
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = None
+        if self.cap.isOpened():
+            self._thread = threading.Thread(target=self._decode, daemon=True)
+            self._thread.start()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decode(self):
+        decoded = 0
+        try:
+            while not self._stop.is_set() and (self.count is None or decoded < self.count):
+                # keep frames start, start + skip, ... and only grab the ones after each kept frame
+                ret, frame = self.cap.read()
+                if not ret:
+                    return
+                if self.scale != 1:
+                    frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                if not self._put(frame):
+                    return
+                decoded += 1
+                for _ in range(self.skip - 1):
+                    if not self.cap.grab():
+                        return
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(_END)
+
+    def read(self):
+        """
+        Returns (ret, frame) like cv2.VideoCapture.read.
+        """
+        if self._thread is None:
+            return False, None
+        frame = self._queue.get()
+        if frame is _END:
+            self._queue.put(_END)  # later reads see the end too
+            if self._error is not None:
+                raise self._error
+            return False, None
+        self.frames_read += 1
+        return True, frame
+
+    def __iter__(self):
+        while True:
+            ret, frame = self.read()
+            if not ret:
+                return
+            yield frame
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class VideoWriter(object):
+    """
+    Encodes frames on a background thread, taking them from a queue of at most queue_size frames, so write
+    returns before the frame is encoded. A written frame must not be modified afterwards. Errors of the
+    encoder thread are raised from the next write or from release.
+    """
+
+    def __init__(self, path, fourcc, fps, size, queue_size=32, is_color=True):
+        if isinstance(fourcc, str):
+            fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.out = cv2.VideoWriter(path, fourcc, fps, size, isColor=is_color)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._error = None
+        self._thread = threading.Thread(target=self._encode, daemon=True)
+        self._thread.start()
+
+    def isOpened(self):
+        return self.out.isOpened()
+
+    def _encode(self):
+        while True:
+            frame = self._queue.get()
+            if frame is _END:
+                return
+            if self._error is None:
+                try:
+                    self.out.write(frame)
+                except Exception as e:
+                    self._error = e
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def release(self):
+        """
+        Waits for the queued frames to be encoded and closes the file.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_END)
+            self._thread.join()
+        self.out.release()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
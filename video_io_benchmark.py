@@ -0,0 +1,166 @@
+"""
+Benchmarks the threaded video I/O of video_io.py against plain cv2.VideoCapture and cv2.VideoWriter loops.
+
+    $ python video_io_benchmark.py --input input.mp4 --work_ms 10
+
+The decode and encode rows measure I/O alone. The pipeline rows copy the video while blurring every frame
+for about work_ms of CPU time, measured without I/O running, which shows how much of the I/O the threads
+hide when they compete with the processing for the CPU, as they do in the tools.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+
+from video_io import VideoReader, VideoWriter
+
+
+def work(frame, iterations):
+    # stands in for CPU-bound per-frame processing that releases the GIL, like OpenCV or torch calls
+    for _ in range(iterations):
+        cv2.GaussianBlur(frame, (9, 9), 0)
+
+
+def work_iterations(frame, work_ms):
+    """
+    Returns the number of blurs of frame that take about work_ms on their own.
+    """
+    if work_ms <= 0:
+        return 0
+    iterations = 1
+    while True:
+        start_time = time.perf_counter()
+        work(frame, iterations)
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= 0.2:
+            return max(1, int(round(iterations * work_ms / 1000. / elapsed)))
+        iterations *= 2
+
+
+def plain_decode(path, skip=1, scale=1.):
+    cap = cv2.VideoCapture(path)
+    count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if scale != 1:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        count += 1
+        for _ in range(skip - 1):
+            cap.grab()
+    cap.release()
+    return count
+
+
+def threaded_decode(path, skip=1, scale=1.):
+    with VideoReader(path, skip=skip, scale=scale) as reader:
+        return sum(1 for _ in reader)
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def plain_encode(frames, path, fps):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frames[0].shape[1], frames[0].shape[0]))
+    for frame in frames:
+        out.write(frame)
+    out.release()
+    return len(frames)
+
+
+def threaded_encode(frames, path, fps):
+    out = VideoWriter(path, 'mp4v', fps, (frames[0].shape[1], frames[0].shape[0]))
+    for frame in frames:
+        out.write(frame)
+    out.release()
+    return len(frames)
+
+
+def plain_pipeline(path, output_path, iterations):
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        work(frame, iterations)
+        out.write(frame)
+        count += 1
+    cap.release()
+    out.release()
+    return count
+
+
+def threaded_pipeline(path, output_path, iterations):
+    reader = VideoReader(path)
+    out = VideoWriter(output_path, 'mp4v', reader.fps, reader.size)
+    count = 0
+    for frame in reader:
+        work(frame, iterations)
+        out.write(frame)
+        count += 1
+    reader.release()
+    out.release()
+    return count
+
+
+def timed(fn, *args):
+    start_time = time.perf_counter()
+    frames = fn(*args)
+    return frames / (time.perf_counter() - start_time)
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Video I/O benchmark')
+    parser.add_argument("--input", help="Input video.", type=str, default='input.mp4')
+    parser.add_argument("--skip", help="Frame skip of the skip rows.", type=int, default=2)
+    parser.add_argument("--scale", help="Downscale of the scale rows.", type=float, default=0.5)
+    parser.add_argument("--work_ms", help="CPU time of the simulated processing of a frame in the pipeline rows.",
+                        type=float, default=10.)
+    parser.add_argument("--json", help="Write the results to this file.", type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    output_path = os.path.join(tempfile.gettempdir(), 'video_io_benchmark.mp4')
+    frames = read_frames(args.input)
+    fps = cv2.VideoCapture(args.input).get(cv2.CAP_PROP_FPS)
+    iterations = work_iterations(frames[0], args.work_ms)
+    rows = [('decode', timed(plain_decode, args.input), timed(threaded_decode, args.input)),
+            ('decode skip %d' % args.skip, timed(plain_decode, args.input, args.skip),
+             timed(threaded_decode, args.input, args.skip)),
+            ('decode scale %g' % args.scale, timed(plain_decode, args.input, 1, args.scale),
+             timed(threaded_decode, args.input, 1, args.scale)),
+            ('encode', timed(plain_encode, frames, output_path, fps), timed(threaded_encode, frames, output_path, fps)),
+            ('pipeline %g ms' % args.work_ms, timed(plain_pipeline, args.input, output_path, iterations),
+             timed(threaded_pipeline, args.input, output_path, iterations))]
+    os.remove(output_path)
+
+    print('%-20s %10s %10s %8s' % ('', 'plain fps', 'video_io', 'speedup'))
+    for name, plain, threaded in rows:
+        print('%-20s %10.1f %10.1f %8.2f' % (name, plain, threaded, threaded / plain))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'name': name, 'plain_fps': plain, 'video_io_fps': threaded} for name, plain, threaded in rows],
+                      f, indent=2)
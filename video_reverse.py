@@ -1,27 +1,223 @@
-import cv2
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import tqdm
 
+from video_io import VideoReader, VideoWriter, video_properties
 
-def reverse_video(input_path, output_path):
-    cap = cv2.VideoCapture(input_path)
-    frames = []
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+# Frames buffered by each reader and writer of reverse_video_streaming, which count towards its memory budget
+QUEUE_FRAMES = 4
 
-    for _ in tqdm.trange(total_frames, desc="Reading frames"):
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
-    cap.release()
+
+def reverse_video(input_path, output_path):
+    reader = VideoReader(input_path)
+    frames = list(tqdm.tqdm(reader, total=reader.frame_count, desc="Reading frames"))
+    reader.release()
 
     height, width = frames[0].shape[:2]
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, 30.0, (width, height))
+    out = VideoWriter(output_path, 'mp4v', reader.fps, (width, height))
 
     for frame in tqdm.tqdm(reversed(frames), total=len(frames), desc="Writing frames"):
         out.write(frame)
     out.release()
 
 
+def spill_chunk(frames, path, spill):
+    """
+    Writes the frames of a chunk in reverse order to a temporary segment file, losslessly.
+    """
+    if spill == 'raw':
+        segment = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=frames[0].dtype,
+                                            shape=(len(frames),) + frames[0].shape)
+        for i, frame in enumerate(reversed(frames)):
+            segment[i] = frame
+        segment.flush()
+        del segment
+    else:
+        height, width = frames[0].shape[:2]
+        out = VideoWriter(path + '.mkv', 'FFV1', 30.0, (width, height))
+        if not out.isOpened():
+            out.release()
+            raise RuntimeError("This OpenCV build cannot write FFV1 video, spill 'raw' segments instead.")
+        for frame in reversed(frames):
+            out.write(frame)
+        out.release()
+
+
+def read_segment(path, spill):
+    if spill == 'raw':
+        for frame in np.load(path + '.npy', mmap_mode='r'):
+            yield frame
+    else:
+        with VideoReader(path + '.mkv', prefetch=QUEUE_FRAMES) as reader:
+            for frame in reader:
+                yield frame
+
+
+def reverse_video_streaming(input_path, output_path, max_memory_mb=512, spill='ffv1', temp_dir=None):
+    """
+    Reverses a video holding at most max_memory_mb of decoded frames in memory, whatever its length. The
+    video is decoded forward in chunks that fit the budget, each chunk is spilled reversed to a temporary
+    segment file, and the segments are then written out last to first. Segments are lossless, either
+    FFV1-compressed video ('ffv1') or uncompressed memory-mapped arrays ('raw', faster but as large on disk
+    as the decoded video), so the output frames are the same as reverse_video's.
+    """
+    # besides a chunk, memory holds the reader's prefetch queue while reading, and the prefetch queue of the
+    # segment reader and the writer's queue while writing
+    reader = VideoReader(input_path, prefetch=QUEUE_FRAMES)
+    width, height = reader.size
+    chunk_frames = max(1, int(max_memory_mb * 2 ** 20) // (width * height * 3) - 2 * QUEUE_FRAMES)
+
+    work_dir = tempfile.mkdtemp(prefix='video_reverse_', dir=temp_dir)
+    try:
+        segments = []
+        frames = []
+        with tqdm.tqdm(total=reader.frame_count, desc="Reading frames") as bar:
+            while True:
+                ret, frame = reader.read()
+                if ret:
+                    frames.append(frame)
+                    bar.update(1)
+                if frames and (len(frames) == chunk_frames or not ret):
+                    segments.append(os.path.join(work_dir, 'segment%06d' % len(segments)))
+                    spill_chunk(frames, segments[-1], spill)
+                    frames = []
+                if not ret:
+                    break
+        reader.release()
+
+        out = VideoWriter(output_path, 'mp4v', reader.fps, (width, height), queue_size=QUEUE_FRAMES)
+        with tqdm.tqdm(total=reader.frames_read, desc="Writing frames") as bar:
+            for segment in reversed(segments):
+                for frame in read_segment(segment, spill):
+                    out.write(frame)
+                    bar.update(1)
+        out.release()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def reverse_segment(input_path, output_path, start, stop, fps):
+    """
+    Encodes frames start <= frame < stop of the input in reverse order, for reverse_video_parallel.
+    Returns the number of frames written.
+    """
+    with VideoReader(input_path, start=start, count=stop - start) as reader:
+        frames = list(reader)
+    if not frames:
+        return 0
+    height, width = frames[0].shape[:2]
+    out = VideoWriter(output_path, 'mp4v', fps, (width, height))
+    for frame in reversed(frames):
+        out.write(frame)
+    out.release()
+    return len(frames)
+
+
+def concatenate_videos(paths, output_path, fps):
+    """
+    Joins videos end to end: by stream copy with ffmpeg when it is installed, else by re-encoding with OpenCV.
+    """
+    if shutil.which('ffmpeg'):
+        list_path = output_path + '.concat.txt'
+        with open(list_path, 'w') as f:
+            for path in paths:
+                f.write("file '%s'\n" % os.path.abspath(path).replace("'", "'\\''"))
+        try:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+                            '-c', 'copy', output_path], check=True)
+        finally:
+            os.remove(list_path)
+        return
+    out = None
+    for path in paths:
+        with VideoReader(path) as reader:
+            for frame in reader:
+                if out is None:
+                    out = VideoWriter(output_path, 'mp4v', fps, (frame.shape[1], frame.shape[0]))
+                out.write(frame)
+    if out is not None:
+        out.release()
+
+
+def reverse_video_parallel(input_path, output_path, workers=None, segment_frames=250, temp_dir=None):
+    """
+    Reverses a video on a pool of worker processes. The video is cut into ranges of segment_frames frames,
+    each worker decodes one range and encodes it reversed, and the segments are then joined last to first.
+    A worker holds one segment of decoded frames in memory at a time.
+    """
+    fps, _, total_frames = video_properties(input_path)
+
+    if not shutil.which('ffmpeg'):
+        print("ffmpeg not found: the segments are joined by re-encoding them, which is slow and loses some quality")
+    starts = list(range(0, total_frames, segment_frames))
+    work_dir = tempfile.mkdtemp(prefix='video_reverse_', dir=temp_dir)
+    try:
+        paths = [os.path.join(work_dir, 'segment%06d.mp4' % i) for i in range(len(starts))]
+        # the last range is open ended, as the frame count of some containers is only an estimate
+        stops = starts[1:] + [2 ** 62]
+        with ProcessPoolExecutor(workers) as executor:
+            counts = list(tqdm.tqdm(executor.map(reverse_segment, [input_path] * len(starts), paths, starts, stops,
+                                                 [fps] * len(starts)),
+                                    total=len(starts), desc="Reversing segments"))
+        concatenate_videos([path for path, count in reversed(list(zip(paths, counts))) if count], output_path,
+                           fps)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark(input_path, worker_counts, segment_frames=250, temp_dir=None):
+    """
+    Times reverse_video and reverse_video_parallel with each worker count on the input, and prints the speedups.
+    """
+    output_path = os.path.join(tempfile.gettempdir(), 'video_reverse_benchmark.mp4')
+    start_time = time.perf_counter()
+    reverse_video(input_path, output_path)
+    serial = time.perf_counter() - start_time
+    print('%-12s %9s %8s' % ('mode', 'seconds', 'speedup'))
+    print('%-12s %9.2f %8.2f' % ('in-memory', serial, 1.))
+    for workers in worker_counts:
+        start_time = time.perf_counter()
+        reverse_video_parallel(input_path, output_path, workers, segment_frames, temp_dir)
+        elapsed = time.perf_counter() - start_time
+        print('%-12s %9.2f %8.2f' % ('%d workers' % workers, elapsed, serial / elapsed))
+    os.remove(output_path)
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Reverse a video')
+    parser.add_argument("--input", help="Input video.", type=str, default='reverse_me.MP4')
+    parser.add_argument("--output", help="Reversed output video.", type=str, default='output_reversed.mp4')
+    parser.add_argument("--max_memory", help="Stream the video through temporary segments, holding at most this many "
+                                             "MB of frames in memory (0 loads the whole video).",
+                        type=int, default=0)
+    parser.add_argument("--spill", help="Temporary segment format when streaming.", type=str,
+                        choices=['ffv1', 'raw'], default='ffv1')
+    parser.add_argument("--workers", help="Reverse segments on this many processes (0 disables parallel mode).",
+                        type=int, default=0)
+    parser.add_argument("--segment_frames", help="Frames per segment in parallel mode.", type=int, default=250)
+    parser.add_argument("--benchmark", help="Time the in-memory mode against parallel mode with these worker counts.",
+                        type=int, nargs='+', default=None)
+    parser.add_argument("--temp_dir", help="Directory for the temporary segments (default: the system's).", type=str,
+                        default=None)
+    args = parser.parse_args()
+    return args
+
+
 if __name__ == "__main__":
-    reverse_video("reverse_me.MP4", "output_reversed.mp4")
\ No newline at end of file
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.input, args.benchmark, args.segment_frames, args.temp_dir)
+    elif args.workers > 0:
+        reverse_video_parallel(args.input, args.output, args.workers, args.segment_frames, args.temp_dir)
+    elif args.max_memory > 0:
+        reverse_video_streaming(args.input, args.output, args.max_memory, args.spill, args.temp_dir)
+    else:
+        reverse_video(args.input, args.output)